@@ -0,0 +1,380 @@
+"""
+Offline benchmarks of the render and asset pipeline
+
+    python benchmarks/bench.py -o result.json
+    python benchmarks/bench.py --browser --font path/to/font.ttf
+
+Everything runs in a temporary folder against a local HTTP server that serves
+generated fixture stickers and a local font in place of the asset repositories,
+nothing is downloaded. Results are printed as JSON so runs of different commits
+can be compared.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+ROOT = Path(__file__).parent.parent
+
+FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/System/Library/Fonts/Supplemental/Arial.ttf",
+    "C:/Windows/Fonts/arial.ttf",
+]
+FIXTURE_COLORS = ["#ff6699", "#33aaee", "#88dd44", "#ffbb22", "#aa66ff", "#44ccbb"]
+
+
+def find_font(path: Optional[str]) -> Path:
+    if path:
+        return Path(path)
+    for x in FONT_CANDIDATES:
+        if Path(x).exists():
+            return Path(x)
+    sys.exit("No TrueType font found, specify one with --font")
+
+
+def make_fixtures(folder: Path, font: Path, characters: int, per_character: int):
+    """Lay out files like the asset repositories do"""
+
+    from PIL import Image, ImageDraw
+
+    stickers: List[Dict[str, Any]] = []
+    for c in range(characters):
+        character = f"character{c}"
+        color = FIXTURE_COLORS[c % len(FIXTURE_COLORS)]
+        for i in range(per_character):
+            img = f"{character}/{character}_{i:02d}.png"
+            path = folder / "public" / "img" / img
+            path.parent.mkdir(parents=True, exist_ok=True)
+
+            im = Image.new("RGBA", (296, 256), (0, 0, 0, 0))
+            draw = ImageDraw.Draw(im)
+            draw.ellipse((40 + i * 4, 30, 256 - i * 4, 250), fill=color)
+            draw.rectangle((110, 90 + i * 3, 186, 160), fill="#ffffff")
+            im.save(path)
+
+            stickers.append(
+                {
+                    "id": f"{c}-{i}",
+                    "name": f"{character} {i:02d}",
+                    "character": character,
+                    "img": img,
+                    "color": color,
+                    "defaultText": {
+                        "text": f"Sticker\n{c}-{i}",
+                        "x": 148,
+                        "y": 58,
+                        "r": (i % 5 - 2) * 4,
+                        "s": 40,
+                    },
+                },
+            )
+
+    info = folder / "src" / "characters.json"
+    info.parent.mkdir(parents=True, exist_ok=True)
+    info.write_text(json.dumps(stickers), "u8")
+
+    font_path = folder / "fonts" / "YurukaFangTang.ttf"
+    font_path.parent.mkdir(parents=True, exist_ok=True)
+    font_path.write_bytes(font.read_bytes())
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *_: Any):
+        pass
+
+
+def serve(folder: Path) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0),
+        partial(QuietHandler, directory=str(folder)),
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def summarize(samples: List[float]) -> Dict[str, Any]:
+    ordered = sorted(samples)
+    return {
+        "n": len(samples),
+        "mean": statistics.fmean(samples),
+        "median": statistics.median(samples),
+        "p95": ordered[min(int(0.95 * len(ordered)), len(ordered) - 1)],
+        "min": ordered[0],
+        "max": ordered[-1],
+    }
+
+
+class Bench:
+    def __init__(self, iterations: int) -> None:
+        self.iterations = iterations
+        self.results: Dict[str, Any] = {}
+
+    async def run(
+        self,
+        name: str,
+        func: Callable[[int], Awaitable[Any]],
+        iterations: Optional[int] = None,
+        setup: Optional[Callable[[], Awaitable[Any]]] = None,
+    ):
+        """`func` gets the iteration index, `setup` runs untimed before each"""
+
+        samples: List[float] = []
+        try:
+            for i in range(iterations or self.iterations):
+                if setup:
+                    await setup()
+                start = time.perf_counter()
+                await func(i)
+                samples.append(time.perf_counter() - start)
+        except Exception as e:
+            self.results[name] = {"error": f"{e.__class__.__name__}: {e}"}
+        else:
+            self.results[name] = summarize(samples)
+        print(f"{name}: {self.results[name]}", file=sys.stderr)
+
+    async def run_sync(self, name: str, func: Callable[[int], Any], **kwargs: Any):
+        async def wrapper(i: int):
+            func(i)
+
+        await self.run(name, wrapper, **kwargs)
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],  # noqa: S607
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+async def main(args: argparse.Namespace, base_url: str):
+    import nonebot
+    from nonebot.log import logger
+
+    # nonebot logs to stdout by default, keep it clean for the JSON
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    nonebot.init(
+        pjsk_assets_prefix=[base_url],
+        pjsk_repo_prefix=[base_url],
+        pjsk_req_retry=0,
+        pjsk_revalidate_assets=False,
+        pjsk_prerender_grids=False,
+        pjsk_render_backend="native",
+        pjsk_render_concurrency=1000,
+        pjsk_render_queue_size=1000,
+        pjsk_cache_backend=args.cache_backend,
+        pjsk_cache_redis_url=args.redis_url,
+    )
+    sys.path.insert(0, str(ROOT))
+    nonebot.load_plugin("nonebot_plugin_pjsk")
+
+    from nonebot_plugin_pjsk.cache import (
+        close_cache_backend,
+        get_cache_backend,
+        memory_cache,
+    )
+    from nonebot_plugin_pjsk.config import config
+    from nonebot_plugin_pjsk.page import page_pool
+    from nonebot_plugin_pjsk.render import (
+        get_all_characters_grid,
+        get_character_stickers_grid,
+        get_sticker,
+        get_sticker_cache_key_maker,
+        make_sticker_render_kwargs,
+        render_sticker_html,
+    )
+    from nonebot_plugin_pjsk.resource import (
+        DATA_FOLDER,
+        get_catalog,
+        prepare_resource,
+    )
+    from nonebot_plugin_pjsk.utils import close_client
+
+    bench = Bench(args.iterations)
+
+    async def clear_memory_cache():
+        memory_cache.clear()
+
+    async def clear_cache():
+        memory_cache.clear()
+        await get_cache_backend().clear()
+
+    async def remove_assets():
+        for folder in ("fonts", "resource"):
+            for path in (DATA_FOLDER / folder).rglob("*"):
+                if path.is_file():
+                    path.unlink()
+        for name in ("characters.json", "manifest.json"):
+            (DATA_FOLDER / name).unlink(missing_ok=True)
+
+    await bench.run(
+        "prepare_resource.cold",
+        lambda _: prepare_resource(),
+        iterations=max(args.iterations // 10, 1),
+        setup=remove_assets,
+    )
+    await bench.run("prepare_resource.warm", lambda _: prepare_resource())
+
+    stickers = get_catalog().stickers
+    params = [make_sticker_render_kwargs(x, auto_adjust=True) for x in stickers]
+    first = stickers[0]
+
+    await bench.run_sync(
+        "make_sticker_render_kwargs",
+        lambda i: make_sticker_render_kwargs(
+            stickers[i % len(stickers)],
+            text=f"Benchmark text {i}",
+            auto_adjust=True,
+        ),
+        iterations=args.iterations * 10,
+    )
+    await bench.run_sync(
+        "cache_key.sticker",
+        lambda i: get_sticker_cache_key_maker(**params[i % len(params)]),
+        iterations=args.iterations * 10,
+    )
+    await bench.run(
+        "template.sticker",
+        lambda i: render_sticker_html(**params[i % len(params)]),
+        iterations=args.iterations * 10,
+    )
+
+    backends = ["native", "browser"] if args.browser else ["native"]
+    for backend in backends:
+        config.pjsk_render_backend = backend  # type: ignore
+        await bench.run(
+            f"get_sticker.{backend}.cold",
+            lambda i: get_sticker(
+                **make_sticker_render_kwargs(first, text=f"Cold {backend} {i}"),
+            ),
+        )
+        if "error" in bench.results[f"get_sticker.{backend}.cold"]:
+            continue
+
+        cached = make_sticker_render_kwargs(first, text=f"Cached {backend}")
+        await get_sticker(**cached)
+        await bench.run(
+            f"get_sticker.{backend}.cached",
+            lambda _: get_sticker(**cached),
+            iterations=args.iterations * 10,
+        )
+        await bench.run(
+            f"get_sticker.{backend}.cached_disk",
+            lambda _: get_sticker(**cached),
+            setup=clear_memory_cache,
+        )
+
+    browser_ok = args.browser and (
+        "error" not in bench.results["get_sticker.browser.cold"]
+    )
+    character = first.character
+    for backend in ["native", "browser"] if browser_ok else ["native"]:
+        config.pjsk_grid_backend = backend  # type: ignore
+        await bench.run(
+            f"grid.{backend}.all_characters.cold",
+            lambda _: get_all_characters_grid(),
+            setup=clear_cache,
+        )
+        await bench.run(
+            f"grid.{backend}.character.cold",
+            lambda _: get_character_stickers_grid(character),
+            setup=clear_cache,
+        )
+        await bench.run(
+            f"grid.{backend}.character.cached",
+            lambda _: get_character_stickers_grid(character),
+            iterations=args.iterations * 10,
+        )
+
+    if args.browser:
+        from nonebot_plugin_htmlrender.browser import shutdown_browser
+
+        await page_pool.close()
+        await shutdown_browser()
+
+    await close_client()
+    await close_cache_backend()
+
+    return {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "unit": "s",
+        "options": {
+            "iterations": args.iterations,
+            "characters": args.characters,
+            "stickers_per_character": args.stickers,
+            "browser": args.browser,
+            "cache_backend": args.cache_backend,
+        },
+        "results": bench.results,
+    }
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--font", help="TrueType font used as the sticker font")
+    parser.add_argument("--characters", type=int, default=6)
+    parser.add_argument("--stickers", type=int, default=4, help="per character")
+    parser.add_argument("-n", "--iterations", type=int, default=20)
+    parser.add_argument(
+        "--browser",
+        action="store_true",
+        help="also benchmark browser renders and grids, needs Playwright Chromium",
+    )
+    parser.add_argument(
+        "--cache-backend",
+        default="filesystem",
+        help="render cache backend, `filesystem`, `sqlite` or `redis`",
+    )
+    parser.add_argument("--redis-url", default="redis://localhost:6379/0")
+    parser.add_argument("-o", "--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+    font = find_font(args.font)
+
+    with tempfile.TemporaryDirectory(prefix="pjsk-bench-") as tmp:
+        assets_folder = Path(tmp) / "assets"
+        workdir = Path(tmp) / "bot"
+        workdir.mkdir()
+        make_fixtures(assets_folder, font, args.characters, args.stickers)
+        server = serve(assets_folder)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+        os.chdir(workdir)  # plugin data folder is relative to cwd
+        try:
+            result = asyncio.run(main(args, base_url))
+        finally:
+            os.chdir(ROOT)
+            server.shutdown()
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, "u8")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,152 @@
+"""
+Import time budget check of the plugin
+
+    python benchmarks/importtime.py
+    python benchmarks/importtime.py --budget 150 --top 20
+
+Loads the plugin in a fresh interpreter under `python -X importtime`, after its
+required plugins are loaded so only the time spent on this plugin is counted.
+Exits with a non-zero status when loading takes longer than the budget, when it
+imports one of the modules that should only be imported on first use, or when
+it touches the data folder. `tests/test_importtime.py` runs the same check,
+without the budget unless `PJSK_IMPORTTIME_BUDGET` is set, as wall clock time
+depends on the machine and its load.
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).parent.parent
+
+DEFAULT_BUDGET = 150
+DEFERRED_MODULES = ["httpx", "PIL", "fontTools"]
+START_MARKER = "pjsk-importtime-start"
+END_MARKER = "pjsk-importtime-end"
+
+CHILD_SCRIPT = f"""
+import json, sys, time
+
+import nonebot
+from nonebot.log import logger
+
+logger.remove()
+nonebot.init()
+nonebot.require("nonebot_plugin_alconna")
+nonebot.require("nonebot_plugin_htmlrender")
+
+before = set(sys.modules)
+print("{START_MARKER}", file=sys.stderr, flush=True)
+start = time.perf_counter()
+nonebot.load_plugin("nonebot_plugin_pjsk")
+elapsed = time.perf_counter() - start
+print("{END_MARKER}", file=sys.stderr, flush=True)
+
+print(json.dumps({{"elapsed": elapsed, "modules": sorted(set(sys.modules) - before)}}))
+"""
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s*(\d+) \|\s*(\d+) \|( *)(\S+)$")
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """`(module, self_us, cumulative_us)` of modules imported by the plugin"""
+
+    lines = stderr.splitlines()
+    try:
+        lines = lines[lines.index(START_MARKER) + 1 : lines.index(END_MARKER)]
+    except ValueError:
+        return []
+
+    result: List[Tuple[str, int, int]] = []
+    for line in lines:
+        if match := IMPORTTIME_LINE.match(line):
+            self_us, cumulative_us, _, name = match.groups()
+            result.append((name, int(self_us), int(cumulative_us)))
+    return result
+
+
+def run_child(workdir: Path) -> Tuple[Dict[str, Any], str]:
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([str(ROOT), *sys.path])}
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD_SCRIPT],
+        cwd=workdir,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Loading plugin failed:\n{proc.stderr[-4000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1]), proc.stderr
+
+
+def check_importtime(
+    budget: Optional[float],
+    deferred: List[str],
+) -> Tuple[float, List[Tuple[str, int, int]], List[str]]:
+    """
+    Loads the plugin once, returns the milliseconds it took, the modules it
+    imported and the checks it failed, the budget is not checked when `None`
+    """
+
+    with tempfile.TemporaryDirectory(prefix="pjsk-importtime-") as tmp:
+        workdir = Path(tmp)
+        result, stderr = run_child(workdir)
+        touched_data = (workdir / "data").exists()
+
+    elapsed_ms = result["elapsed"] * 1000
+    loaded = {x.split(".")[0] for x in result["modules"]}
+    deferred_loaded = sorted(set(deferred) & loaded)
+
+    errors: List[str] = []
+    if budget is not None and elapsed_ms > budget:
+        errors.append(f"over budget by {elapsed_ms - budget:.1f}ms")
+    if deferred_loaded:
+        errors.append(f"imported on load: {', '.join(deferred_loaded)}")
+    if touched_data:
+        errors.append("data folder created on load")
+    return elapsed_ms, parse_importtime(stderr), errors
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=DEFAULT_BUDGET,
+        help="milliseconds loading the plugin may take",
+    )
+    parser.add_argument("--top", type=int, default=10, help="slowest imports shown")
+    parser.add_argument(
+        "--deferred",
+        nargs="*",
+        default=DEFERRED_MODULES,
+        help="top level modules the plugin should not import on load",
+    )
+    args = parser.parse_args()
+
+    try:
+        elapsed_ms, imports, errors = check_importtime(args.budget, args.deferred)
+    except RuntimeError as e:
+        sys.exit(str(e))
+
+    print(f"Plugin loaded in {elapsed_ms:.1f}ms (budget {args.budget:.0f}ms)")
+    print(f"Slowest imports by self time, of {len(imports)}:")
+    for name, self_us, cumulative_us in sorted(imports, key=lambda x: -x[1])[
+        : args.top
+    ]:
+        print(f"  {self_us / 1000:8.1f}ms {cumulative_us / 1000:8.1f}ms  {name}")
+
+    if errors:
+        sys.exit("Import time check failed, " + "; ".join(errors))
+    print("Import time check passed")
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,11 +1,12 @@
 import math
+from contextlib import suppress
 from typing import List, Optional
 
 from nonebot import logger, on_command, on_shell_command
-from nonebot.adapters import Message
+from nonebot.adapters import Bot, Event, Message
 from nonebot.exception import ParserExit
 from nonebot.matcher import Matcher
-from nonebot.params import Arg, ArgPlainText, CommandArg, ShellCommandArgs
+from nonebot.params import Arg, ArgPlainText, CommandArg, Depends, ShellCommandArgs
 from nonebot.rule import ArgumentParser, Namespace
 from nonebot.typing import T_State
 from nonebot_plugin_alconna.uniseg import UniMessage
@@ -21,8 +22,15 @@ from .render import (
     get_sticker,
     make_sticker_render_kwargs,
 )
-from .resource import select_or_get_random
+from .resource import get_catalog, select_or_get_random
+from .scheduler import (
+    RenderBusyError,
+    RenderRateLimitedError,
+    Requester,
+    requester_var,
+)
 from .utils import ResolveValueError, resolve_value
+from .warmup import sticker_popularity
 
 cmd_sticker_list = on_command(
     "pjsk列表",
@@ -94,15 +102,44 @@ async def handle_exit(matcher: Matcher, arg: str):
         await matcher.finish("已退出交互创建模式")
 
 
+async def set_render_requester(bot: Bot, event: Event):
+    """marks renders started by the handler as requested by the event sender"""
+
+    try:
+        user_id = event.get_user_id()
+    except Exception:
+        return
+
+    group_id = None
+    with suppress(Exception):
+        target = UniMessage.get_target(event, bot)
+        if not target.private:
+            group_id = target.id
+    requester_var.set(Requester(user_id, group_id))
+
+
+RenderRequester = Depends(set_render_requester)
+
+
+def format_busy_error(error: Exception) -> Optional[str]:
+    if isinstance(error, RenderBusyError):
+        return "当前生成任务过多，请稍后再试"
+    if isinstance(error, RenderRateLimitedError):
+        return "操作过于频繁，请稍后再试"
+    return None
+
+
 def format_draw_error(error: Exception) -> str:
     if isinstance(error, ResolveValueError):
         return f"提供的参数值 `{error.args[0]}` 解析出错"
+    if msg := format_busy_error(error):
+        return msg
     logger.opt(exception=error).error("Error occurred while drawing sticker")
     return "生成表情时出错，请检查后台日志"
 
 
 # failed to parse args
-@cmd_generate.handle()
+@cmd_generate.handle(parameterless=[RenderRequester])
 async def _(matcher: Matcher, foo: ParserExit = ShellCommandArgs()):
     if not foo.message:
         return
@@ -113,7 +150,9 @@ async def _(matcher: Matcher, foo: ParserExit = ShellCommandArgs()):
 
         try:
             img = await get_help(HELP)
-        except Exception:
+        except Exception as e:
+            if msg := format_busy_error(e):
+                await matcher.finish(msg)
             logger.exception("Error occurred while rendering help image")
             await matcher.finish("生成帮助图片时出错，请检查后台日志")
         await UniMessage.image(raw=img).send(reply_to=config.pjsk_reply)
@@ -123,7 +162,7 @@ async def _(matcher: Matcher, foo: ParserExit = ShellCommandArgs()):
 
 
 # command or enter interact mode handler
-@cmd_generate.handle()
+@cmd_generate.handle(parameterless=[RenderRequester])
 async def _(matcher: Matcher, args: Namespace = ShellCommandArgs()):
     if not any(vars(args).values()):  # 没有任何参数
         matcher.skip()  # 跳过该 handler 进入交互模式
@@ -160,6 +199,7 @@ async def _(matcher: Matcher, args: Namespace = ShellCommandArgs()):
     except Exception as e:
         await matcher.finish(format_draw_error(e))
 
+    sticker_popularity.record(selected_sticker.sticker_id, kw)
     await UniMessage.image(raw=image).send(reply_to=config.pjsk_reply)
     await matcher.finish()
 
@@ -172,8 +212,8 @@ async def _(matcher: Matcher, arg: Message = CommandArg()):
 
 
 # character list
-@cmd_generate.handle()
-@cmd_sticker_list.handle()
+@cmd_generate.handle(parameterless=[RenderRequester])
+@cmd_sticker_list.handle(parameterless=[RenderRequester])
 async def _(matcher: Matcher, state: T_State):
     if "character" in state:
         matcher.skip()
@@ -187,7 +227,9 @@ async def _(matcher: Matcher, state: T_State):
 
     try:
         image = await get_all_characters_grid()
-    except Exception:
+    except Exception as e:
+        if msg := format_busy_error(e):
+            await matcher.finish(msg)
         logger.exception("Error occurred while getting character list")
         await matcher.finish("获取角色列表图片出错，请检查后台日志")
 
@@ -198,8 +240,8 @@ async def _(matcher: Matcher, state: T_State):
 
 
 # sticker id list
-@cmd_generate.got("character")
-@cmd_sticker_list.got("character")
+@cmd_generate.got("character", parameterless=[RenderRequester])
+@cmd_sticker_list.got("character", parameterless=[RenderRequester])
 async def _(matcher: Matcher, state: T_State, arg_msg: Message = Arg("character")):
     character = remove_cmd_prefix(arg_msg.extract_plain_text()).strip()
     await handle_exit(matcher, character)
@@ -218,17 +260,19 @@ async def _(matcher: Matcher, state: T_State, arg_msg: Message = Arg("character"
             matcher.set_arg("sticker_id", arg_msg)
             matcher.skip()
 
+    if not get_catalog().resolve_character(character):
+        if interact:
+            await matcher.reject("没有找到对应名称的角色，请重新输入")
+        await matcher.finish("没有找到对应名称的角色")
+
     try:
         image = await get_character_stickers_grid(character)
-    except Exception:
+    except Exception as e:
+        if msg := format_busy_error(e):
+            await matcher.finish(msg)
         logger.exception("Error occurred while getting sticker list")
         await matcher.finish("获取表情列表图片出错，请检查后台日志")
 
-    if not image:
-        if interact:
-            await matcher.reject("没有找到对应名称的角色，请重新输入")
-        await matcher.finish("没有找到对应名称的角色")
-
     msg = UniMessage.image(raw=image)
     if interact:
         msg += "请发送你要生成表情的 ID"
@@ -248,7 +292,7 @@ async def _(matcher: Matcher, arg: str = ArgPlainText("sticker_id")):
     await matcher.send("请发送你想要写在表情上的的文字")
 
 
-@cmd_generate.got("text")
+@cmd_generate.got("text", parameterless=[RenderRequester])
 async def _(
     matcher: Matcher,
     sticker_id: str = ArgPlainText(),
@@ -270,4 +314,5 @@ async def _(
     except Exception as e:
         await matcher.finish(format_draw_error(e))
 
+    sticker_popularity.record(sticker_info.sticker_id, kw)
     await UniMessage.image(raw=image).send(reply_to=config.pjsk_reply)
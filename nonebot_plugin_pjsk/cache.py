@@ -0,0 +1,613 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager, suppress
+from importlib.util import find_spec
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+import anyio
+from nonebot import get_driver, logger
+
+from .config import config
+from .metrics import metrics
+from .resource import CACHE_FOLDER
+from .scheduler import render_scheduler
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+
+CACHE_INDEX_NAME = "index.sqlite3"
+CACHE_DATABASE_NAME = "cache.sqlite3"
+REDIS_DELETE_BATCH = 500
+
+EvictionPolicy = Literal["lru", "lfu"]
+TF = TypeVar("TF", bound=Callable[[], "CacheBackend"])
+
+
+class MemoryCache:
+    """In-process LRU of cached images, bounded by the total bytes it holds"""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[str, bytes]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[bytes]:
+        data = self._data.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return data
+
+    def set(self, key: str, data: bytes):  # noqa: A003
+        if len(data) > self.max_bytes:
+            self.pop(key)
+            return
+        if (old := self._data.pop(key, None)) is not None:
+            self.total_bytes -= len(old)
+        self._data[key] = data
+        self.total_bytes += len(data)
+        # least recently used entries are demoted, they are still on disk
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self.total_bytes -= len(evicted)
+            self.evictions += 1
+
+    def pop(self, key: str):
+        if (old := self._data.pop(key, None)) is not None:
+            self.total_bytes -= len(old)
+
+    def clear(self, suffix: Optional[str] = None):
+        for key in [x for x in self._data if (not suffix) or x.endswith(suffix)]:
+            self.pop(key)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._data),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class CacheBackend(ABC):
+    """Storage of rendered images behind the in-process memory cache"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, data: bytes):  # noqa: A003
+        ...
+
+    @abstractmethod
+    async def clear(self, suffix: Optional[str] = None) -> int:
+        """removes entries with keys ending with `suffix`, or all of them"""
+
+    async def evict(self) -> int:
+        """removes expired entries and entries over the limits"""
+        return 0
+
+    async def close(self):
+        pass
+
+
+class DiskCache(CacheBackend):
+    """
+    Render cache stored as files in a folder, with a SQLite index tracking
+    size, creation time, last access time and hit count of every entry
+    """
+
+    def __init__(
+        self,
+        folder: Path,
+        max_bytes: int = 0,
+        max_entries: int = 0,
+        ttl: float = 0,
+        policy: EvictionPolicy = "lru",
+    ) -> None:
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.policy: EvictionPolicy = policy
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def index_path(self) -> Path:
+        return self.folder / CACHE_INDEX_NAME
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn:
+            return self._conn
+
+        self.folder.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(
+            self.index_path,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, "
+            "size INTEGER NOT NULL, "
+            "created REAL NOT NULL, "
+            "accessed REAL NOT NULL, "
+            "hits INTEGER NOT NULL DEFAULT 0)",
+        )
+        self._conn = conn
+        self._init_storage()
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        assert self._conn
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def _init_storage(self):
+        self._adopt_untracked_files()
+
+    def _read_data(self, key: str) -> Optional[bytes]:
+        try:
+            return (self.folder / key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def _write_data(self, key: str, data: bytes):
+        path = self.folder / key
+        tmp_path = path.with_name(f"{key}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    def _delete_data(self, keys: List[str]):
+        for key in keys:
+            with suppress(FileNotFoundError):
+                (self.folder / key).unlink()
+
+    def _adopt_untracked_files(self):
+        # files written before the index existed, or by an older version
+        assert self._conn
+        tracked = {x for (x,) in self._conn.execute("SELECT key FROM entries")}
+        rows: List[Tuple[str, int, float, float]] = []
+        for path in self.folder.iterdir():
+            if (
+                (not path.is_file())
+                or path.name.startswith(CACHE_INDEX_NAME)
+                or path.name.startswith(CACHE_DATABASE_NAME)
+                or path.name.endswith(".tmp")
+                or path.name in tracked
+            ):
+                continue
+            stat = path.stat()
+            rows.append((path.name, stat.st_size, stat.st_mtime, stat.st_mtime))
+        if rows:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO entries (key, size, created, accessed) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            logger.debug(f"Indexed {len(rows)} untracked cache files")
+
+    def _remove(self, keys: List[str]):
+        assert self._conn
+        with self._transaction():
+            self._delete_data(keys)
+            self._conn.executemany(
+                "DELETE FROM entries WHERE key = ?",
+                [(x,) for x in keys],
+            )
+
+    def get_sync(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT created FROM entries WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if not row:
+                return None
+
+            now = time.time()
+            if self.ttl and (now - row[0] > self.ttl):
+                self._remove([key])
+                return None
+
+            if (data := self._read_data(key)) is None:
+                self._remove([key])
+                return None
+
+            conn.execute(
+                "UPDATE entries SET accessed = ?, hits = hits + 1 WHERE key = ?",
+                (now, key),
+            )
+            return data
+
+    def set_sync(self, key: str, data: bytes):
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            with self._transaction():
+                self._write_data(key, data)
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, size, created, accessed) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, len(data), now, now),
+                )
+
+    def clear_sync(self, suffix: Optional[str] = None) -> int:
+        with self._lock:
+            conn = self._connect()
+            if suffix:
+                keys = [
+                    x
+                    for (x,) in conn.execute(
+                        "SELECT key FROM entries WHERE key LIKE ?",
+                        (f"%{suffix}",),
+                    )
+                ]
+            else:
+                keys = [x for (x,) in conn.execute("SELECT key FROM entries")]
+            self._remove(keys)
+            return len(keys)
+
+    def evict_sync(self) -> int:
+        with self._lock:
+            conn = self._connect()
+            removed = 0
+
+            if self.ttl:
+                expired = [
+                    x
+                    for (x,) in conn.execute(
+                        "SELECT key FROM entries WHERE created < ?",
+                        (time.time() - self.ttl,),
+                    )
+                ]
+                self._remove(expired)
+                removed += len(expired)
+
+            count, total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries",
+            ).fetchone()
+            if not (
+                (self.max_entries and count > self.max_entries)
+                or (self.max_bytes and total > self.max_bytes)
+            ):
+                return removed
+
+            order = "hits ASC, accessed ASC" if self.policy == "lfu" else "accessed ASC"
+            victims: List[str] = []
+            for key, size in conn.execute(
+                f"SELECT key, size FROM entries ORDER BY {order}",  # noqa: S608
+            ):
+                if not (
+                    (self.max_entries and count > self.max_entries)
+                    or (self.max_bytes and total > self.max_bytes)
+                ):
+                    break
+                victims.append(key)
+                count -= 1
+                total -= size
+            self._remove(victims)
+            return removed + len(victims)
+
+    def close_sync(self):
+        with self._lock:
+            if self._conn:
+                self._conn.close()
+                self._conn = None
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await anyio.to_thread.run_sync(self.get_sync, key)
+
+    async def set(self, key: str, data: bytes):  # noqa: A003
+        await anyio.to_thread.run_sync(self.set_sync, key, data)
+
+    async def clear(self, suffix: Optional[str] = None) -> int:
+        return await anyio.to_thread.run_sync(self.clear_sync, suffix)
+
+    async def evict(self) -> int:
+        return await anyio.to_thread.run_sync(self.evict_sync)
+
+    async def close(self):
+        await anyio.to_thread.run_sync(self.close_sync)
+
+
+class SQLiteCache(DiskCache):
+    """
+    Render cache stored in a single SQLite database, images included,
+    so instances on the same machine can share it
+    """
+
+    def __init__(self, path: Path, **kwargs) -> None:
+        super().__init__(path.parent, **kwargs)
+        self.path = path
+
+    @property
+    def index_path(self) -> Path:
+        return self.path
+
+    def _init_storage(self):
+        assert self._conn
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            "key TEXT PRIMARY KEY, "
+            "data BLOB NOT NULL)",
+        )
+
+    def _read_data(self, key: str) -> Optional[bytes]:
+        assert self._conn
+        row = self._conn.execute(
+            "SELECT data FROM blobs WHERE key = ?",
+            (key,),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _write_data(self, key: str, data: bytes):
+        assert self._conn
+        self._conn.execute(
+            "INSERT OR REPLACE INTO blobs (key, data) VALUES (?, ?)",
+            (key, data),
+        )
+
+    def _delete_data(self, keys: List[str]):
+        assert self._conn
+        self._conn.executemany(
+            "DELETE FROM blobs WHERE key = ?",
+            [(x,) for x in keys],
+        )
+
+
+def escape_glob(pattern: str) -> str:
+    return "".join(f"\\{x}" if x in "*?[]\\" else x for x in pattern)
+
+
+class RedisCache(CacheBackend):
+    """
+    Render cache stored in a Redis compatible server, shared by every bot
+    instance connected to it, entries expire after `ttl`, size limits are
+    left to the `maxmemory` policy of the server
+    """
+
+    def __init__(self, url: str, prefix: str, ttl: float = 0) -> None:
+        from redis.asyncio import Redis
+
+        self.client: "Redis" = Redis.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(f"{self.prefix}{key}")
+
+    async def set(self, key: str, data: bytes):  # noqa: A003
+        await self.client.set(
+            f"{self.prefix}{key}",
+            data,
+            px=int(self.ttl * 1000) or None,
+        )
+
+    async def clear(self, suffix: Optional[str] = None) -> int:
+        pattern = f"{escape_glob(self.prefix)}*{escape_glob(suffix or '')}"
+        removed = 0
+        batch: List[bytes] = []
+        async for key in self.client.scan_iter(match=pattern, count=REDIS_DELETE_BATCH):
+            batch.append(key)
+            if len(batch) >= REDIS_DELETE_BATCH:
+                removed += await self.client.delete(*batch)
+                batch.clear()
+        if batch:
+            removed += await self.client.delete(*batch)
+        return removed
+
+    async def close(self):
+        await self.client.aclose()
+
+
+CACHE_BACKENDS: Dict[str, Callable[[], CacheBackend]] = {}
+
+
+def register_cache_backend(name: str) -> Callable[[TF], TF]:
+    def decorator(func: TF) -> TF:
+        CACHE_BACKENDS[name] = func
+        return func
+
+    return decorator
+
+
+@register_cache_backend("filesystem")
+def create_filesystem_cache() -> CacheBackend:
+    return DiskCache(
+        CACHE_FOLDER,
+        max_bytes=config.pjsk_cache_max_bytes,
+        max_entries=config.pjsk_cache_max_entries,
+        ttl=config.pjsk_cache_ttl,
+        policy=config.pjsk_cache_eviction_policy,
+    )
+
+
+@register_cache_backend("sqlite")
+def create_sqlite_cache() -> CacheBackend:
+    return SQLiteCache(
+        (
+            Path(config.pjsk_cache_sqlite_path)
+            if config.pjsk_cache_sqlite_path
+            else CACHE_FOLDER / CACHE_DATABASE_NAME
+        ),
+        max_bytes=config.pjsk_cache_max_bytes,
+        max_entries=config.pjsk_cache_max_entries,
+        ttl=config.pjsk_cache_ttl,
+        policy=config.pjsk_cache_eviction_policy,
+    )
+
+
+@register_cache_backend("redis")
+def create_redis_cache() -> CacheBackend:
+    if not find_spec("redis"):
+        logger.warning(
+            "Package `redis` not installed, using filesystem cache backend, "
+            "install the `redis` extra to enable it",
+        )
+        return create_filesystem_cache()
+    return RedisCache(
+        config.pjsk_cache_redis_url,
+        config.pjsk_cache_redis_prefix,
+        config.pjsk_cache_ttl,
+    )
+
+
+def create_cache_backend() -> CacheBackend:
+    name = config.pjsk_cache_backend
+    if not (factory := CACHE_BACKENDS.get(name)):
+        logger.warning(f"Unknown cache backend `{name}`, using filesystem")
+        return create_filesystem_cache()
+    try:
+        return factory()
+    except Exception:
+        logger.exception(
+            f"Error occurred while creating cache backend `{name}`, "
+            "using filesystem",
+        )
+        return create_filesystem_cache()
+
+
+_backend: Optional[CacheBackend] = None
+
+
+def get_cache_backend() -> CacheBackend:
+    # created on first use so backends registered by other plugins are available
+    global _backend
+    if not _backend:
+        _backend = create_cache_backend()
+    return _backend
+
+
+async def close_cache_backend():
+    global _backend
+    if _backend:
+        await _backend.close()
+        _backend = None
+
+
+memory_cache = MemoryCache(config.pjsk_cache_memory_max_bytes)
+
+
+async def get_cache(filename: str, memory: bool = True) -> Optional[bytes]:
+    if (data := memory_cache.get(filename)) is not None:
+        return data
+    try:
+        with metrics.time("render_stage_seconds", stage="cache_read"):
+            data = await get_cache_backend().get(filename)
+    except Exception:
+        logger.exception("Error while reading cache")
+        return None
+    if memory and (data is not None):
+        memory_cache.set(filename, data)
+    return data
+
+
+async def write_cache(filename: str, data: bytes, memory: bool = True):
+    if memory:
+        memory_cache.set(filename, data)
+    try:
+        with metrics.time("render_stage_seconds", stage="cache_write"):
+            await get_cache_backend().set(filename, data)
+    except Exception:
+        logger.exception("Error while writing cache")
+
+
+def get_cache_stats() -> Dict[str, int]:
+    return {f"memory_{k}": v for k, v in memory_cache.stats().items()}
+
+
+async def clean_cache_on_startup():
+    if not config.pjsk_clear_cache:
+        return
+    try:
+        memory_cache.clear()
+        removed = await get_cache_backend().clear()
+    except Exception:
+        logger.exception("Error occurred while cleaning cache")
+        return
+    logger.debug(f"Removed {removed} cache files on startup")
+
+
+clean_task: Optional["asyncio.Task[None]"] = None
+
+
+async def wait_cache_cleaned():
+    """waits for the startup clean, renders written before it would be lost"""
+    if clean_task:
+        await asyncio.shield(clean_task)
+
+
+async def cache_eviction_loop():
+    await wait_cache_cleaned()
+    while True:
+        try:
+            if removed := await get_cache_backend().evict():
+                logger.debug(f"Evicted {removed} cache entries")
+            logger.debug(f"Cache stats: {get_cache_stats()}")
+            # rate limit buckets of users and groups seen once would pile up
+            render_scheduler.prune_buckets()
+        except Exception:
+            logger.exception("Error occurred while evicting cache")
+        await asyncio.sleep(config.pjsk_cache_sweep_interval)
+
+
+cache_tasks: List["asyncio.Task[None]"] = []
+
+
+async def start_cache_tasks():
+    # cleaning a large cache folder should not hold up startup
+    global clean_task
+    clean_task = asyncio.create_task(clean_cache_on_startup())
+    cache_tasks.append(clean_task)
+    cache_tasks.append(asyncio.create_task(cache_eviction_loop()))
+
+
+async def stop_cache_tasks():
+    for task in cache_tasks:
+        task.cancel()
+    cache_tasks.clear()
+    await close_cache_backend()
+
+
+metrics.register_collector("cache", get_cache_stats)
+
+driver = get_driver()
+driver.on_startup(start_cache_tasks)
+driver.on_shutdown(stop_cache_tasks)
@@ -1,4 +1,4 @@
-from typing import Any, List, Optional, Set
+from typing import Any, Dict, List, Literal, Optional, Set
 from typing_extensions import Annotated
 
 from nonebot import get_plugin_config
@@ -11,6 +11,11 @@ class ConfigModel(BaseModel):
     pjsk_req_retry: int = 1
     pjsk_req_proxy: Optional[str] = None
     pjsk_req_timeout: int = 10
+    pjsk_req_http2: bool = False
+    pjsk_req_race: bool = False
+    pjsk_req_backoff_base: float = 0.5
+    pjsk_req_backoff_max: float = 10
+    pjsk_req_max_connections: int = 20
     pjsk_assets_prefix: List[Annotated[str, HttpUrl]] = Field(
         [
             "https://raw.gitmirror.com/TheOriginalAyaka/sekai-stickers/main/",
@@ -24,10 +29,79 @@ class ConfigModel(BaseModel):
         ],
     )
 
+    pjsk_revalidate_assets: bool = True
+    pjsk_lazy_assets: bool = False
+    pjsk_prefetch_concurrency: int = 2
+    pjsk_bootstrap_archive_urls: List[str] = Field(default_factory=list)
+    pjsk_bootstrap_min_missing: int = 20
+
+    pjsk_character_aliases: Dict[str, str] = Field(default_factory=dict)
+
     pjsk_help_as_image: bool = True
     pjsk_reply: bool = True
     pjsk_use_cache: bool = True
     pjsk_clear_cache: bool = False
+    pjsk_cache_max_bytes: int = 256 * 1024 * 1024
+    pjsk_cache_max_entries: int = 10000
+    pjsk_cache_ttl: int = 0
+    pjsk_cache_eviction_policy: Literal["lru", "lfu"] = "lru"
+    pjsk_cache_sweep_interval: int = 600
+    pjsk_cache_memory_max_bytes: int = 32 * 1024 * 1024
+    pjsk_cache_backend: str = "filesystem"
+    pjsk_cache_sqlite_path: Optional[str] = None
+    pjsk_cache_redis_url: str = "redis://localhost:6379/0"
+    pjsk_cache_redis_prefix: str = "pjsk:cache:"
+
+    pjsk_render_backend: Literal["browser", "native"] = "browser"
+    pjsk_grid_backend: Literal["browser", "native"] = "native"
+    pjsk_asset_memory_max_bytes: int = 64 * 1024 * 1024
+
+    pjsk_inline_assets: bool = False
+    pjsk_page_pool_size: int = 2
+    pjsk_page_pool_max_renders: int = 200
+    pjsk_sticker_batch_size: int = 8
+    pjsk_sticker_batch_window: float = 0
+    pjsk_prerender_grids: bool = True
+    pjsk_prerender_concurrency: int = 2
+    pjsk_warmup_stickers: bool = True
+    pjsk_warmup_top_n: int = 50
+    pjsk_warmup_default_stickers: bool = True
+    pjsk_warmup_interval: int = 600
+    pjsk_warmup_idle_time: float = 30
+    pjsk_warmup_concurrency: int = 1
+    pjsk_warmup_cpu_budget: float = 0.25
+    pjsk_popularity_half_life: int = 3 * 24 * 60 * 60
+
+    pjsk_sticker_format: Literal[
+        "png",
+        "png_optimized",
+        "png_palette",
+        "webp",
+        "jpeg",
+    ] = "png"
+    pjsk_grid_format: Literal[
+        "png",
+        "png_optimized",
+        "png_palette",
+        "webp",
+        "jpeg",
+    ] = "jpeg"
+    pjsk_jpeg_quality: int = 90
+    pjsk_webp_quality: int = 90
+    pjsk_max_image_bytes: int = 0
+
+    pjsk_render_concurrency: int = 4
+    pjsk_render_queue_size: int = 32
+    pjsk_user_rate_limit: float = 0
+    pjsk_user_rate_burst: int = 5
+    pjsk_group_rate_limit: float = 0
+    pjsk_group_rate_burst: int = 20
+    pjsk_render_workers: int = 0
+
+    pjsk_metrics_exporters: List[str] = Field(default_factory=list)
+    pjsk_metrics_max_samples: int = 1024
+    pjsk_metrics_log_interval: int = 300
+    pjsk_metrics_path: str = "/pjsk/metrics"
 
     @validator("pjsk_assets_prefix", "pjsk_repo_prefix", pre=True)
     def str_to_list(cls, v: Any):  # noqa: N805
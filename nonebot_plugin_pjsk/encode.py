@@ -0,0 +1,141 @@
+from io import BytesIO
+from typing import TYPE_CHECKING, Iterator, Literal, NamedTuple, Optional, Tuple
+
+import anyio
+from nonebot import logger
+
+from .config import config
+from .metrics import metrics
+
+if TYPE_CHECKING:
+    from PIL.Image import Image as PILImage
+
+ImageFormat = Literal["png", "png_optimized", "png_palette", "webp", "jpeg"]
+ImageKind = Literal["sticker", "grid"]
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+MIN_QUALITY = 30
+QUALITY_STEP = 10
+PALETTE_COLORS = (256, 128, 64, 32, 16)
+
+
+class ImageEncoding(NamedTuple):
+    format: ImageFormat  # noqa: A003
+    quality: int
+    max_bytes: int
+
+    @property
+    def ext(self) -> str:
+        return "webp" if self.format == "webp" else self.format.split("_")[0]
+
+    @property
+    def lossless(self) -> bool:
+        """whether the browser capture should be png before encoding"""
+        return self.format != "jpeg" or bool(self.max_bytes)
+
+
+def get_image_encoding(kind: ImageKind) -> ImageEncoding:
+    fmt = config.pjsk_sticker_format if kind == "sticker" else config.pjsk_grid_format
+    quality = config.pjsk_webp_quality if fmt == "webp" else config.pjsk_jpeg_quality
+    return ImageEncoding(fmt, quality, config.pjsk_max_image_bytes)
+
+
+def save_image(im: "PILImage", fmt: ImageFormat, quality: int, colors: int) -> bytes:
+    from PIL import Image
+
+    buffer = BytesIO()
+    if fmt == "jpeg":
+        if im.mode in ("RGBA", "LA", "P"):
+            im = im.convert("RGBA")
+            background = Image.new("RGBA", im.size, (255, 255, 255, 255))
+            im = Image.alpha_composite(background, im)
+        im.convert("RGB").save(buffer, "JPEG", quality=quality, optimize=True)
+    elif fmt == "webp":
+        im.save(buffer, "WEBP", quality=quality, method=4)
+    elif fmt == "png_palette":
+        im.convert("RGBA").quantize(
+            colors,
+            method=Image.Quantize.FASTOCTREE,
+        ).save(buffer, "PNG", optimize=True)
+    else:
+        im.save(buffer, "PNG", optimize=fmt == "png_optimized")
+    return buffer.getvalue()
+
+
+def iter_attempts(encoding: ImageEncoding) -> Iterator[Tuple[ImageFormat, int, int]]:
+    """`(format, quality, colors)` to try, each smaller than the previous"""
+
+    yield encoding.format, encoding.quality, PALETTE_COLORS[0]
+    if not encoding.max_bytes:
+        return
+
+    if encoding.format in ("jpeg", "webp"):
+        quality = encoding.quality - QUALITY_STEP
+        while quality >= MIN_QUALITY:
+            yield encoding.format, quality, PALETTE_COLORS[0]
+            quality -= QUALITY_STEP
+        return
+
+    # lossless formats fall back to fewer palette colors
+    start = 1 if encoding.format == "png_palette" else 0
+    for colors in PALETTE_COLORS[start:]:
+        yield "png_palette", encoding.quality, colors
+
+
+def is_encoded(data: bytes, encoding: ImageEncoding) -> bool:
+    return (
+        encoding.format == "png"
+        and data.startswith(PNG_SIGNATURE)
+        and ((not encoding.max_bytes) or len(data) <= encoding.max_bytes)
+    )
+
+
+def encode_pil_image(
+    im: "PILImage",
+    encoding: ImageEncoding,
+    original: Optional[bytes] = None,
+) -> bytes:
+    """
+    Encode an image with the given encoding, when `max_bytes` is set,
+    steps quality or palette size down until the result fits,
+    `original` is the png the image was loaded from, if any
+    """
+
+    smallest: Optional[bytes] = None
+    attempts = iter_attempts(encoding)
+    if encoding.format == "png" and original:
+        smallest = original
+        next(attempts)  # re-saving the same png won't make it smaller
+
+    for fmt, quality, colors in attempts:
+        result = save_image(im, fmt, quality, colors)
+        if (not smallest) or len(result) < len(smallest):
+            smallest = result
+        if (not encoding.max_bytes) or len(result) <= encoding.max_bytes:
+            return result
+
+    assert smallest
+    logger.warning(
+        f"Could not encode image within {encoding.max_bytes} bytes, "
+        f"smallest result is {len(smallest)} bytes",
+    )
+    return smallest
+
+
+def encode_image_sync(data: bytes, encoding: ImageEncoding) -> bytes:
+    if is_encoded(data, encoding):
+        return data
+
+    from PIL import Image
+
+    with Image.open(BytesIO(data)) as im:
+        im.load()
+        original = data if data.startswith(PNG_SIGNATURE) else None
+        return encode_pil_image(im, encoding, original)
+
+
+async def encode_image(data: bytes, encoding: ImageEncoding) -> bytes:
+    if is_encoded(data, encoding):
+        return data
+    with metrics.time("render_stage_seconds", stage="encode"):
+        return await anyio.to_thread.run_sync(encode_image_sync, data, encoding)
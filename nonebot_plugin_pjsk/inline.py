@@ -0,0 +1,89 @@
+import base64
+import hashlib
+from functools import lru_cache
+from importlib.util import find_spec
+from io import BytesIO
+from pathlib import Path
+from typing import Tuple
+
+import anyio
+from nonebot import logger
+
+from .config import config
+from .metrics import metrics
+from .page import from_router_url, get_asset_mime_type
+from .resource import get_file_version
+
+HAS_FONTTOOLS = find_spec("fontTools") is not None
+HAS_BROTLI = (find_spec("brotli") or find_spec("brotlicffi")) is not None
+
+
+def is_inline_enabled() -> bool:
+    return config.pjsk_inline_assets and HAS_FONTTOOLS
+
+
+if config.pjsk_inline_assets and not HAS_FONTTOOLS:
+    logger.warning(
+        "Package `fonttools` not installed, assets will not be inlined, "
+        "install the `inline` extra to enable it",
+    )
+
+
+def get_glyph_set(text: str) -> str:
+    return "".join(sorted(set(text) - {"\n", "\r"}))
+
+
+@lru_cache(maxsize=256)
+def subset_font(path: str, version: str, glyphs: str) -> Tuple[str, str]:
+    """
+    Subset of the font that only has the glyphs, returns font family name
+    unique to the subset and the data uri of the font
+    """
+
+    from fontTools import subset
+
+    options = subset.Options()
+    options.flavor = "woff2" if HAS_BROTLI else "woff"
+    options.layout_features = ["*"]
+    options.notdef_outline = True
+    options.name_IDs = []
+
+    font = subset.load_font(path, options)
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(text=glyphs)
+    subsetter.subset(font)
+
+    buffer = BytesIO()
+    subset.save_font(font, buffer, options)
+    data = base64.b64encode(buffer.getvalue()).decode()
+    digest = hashlib.sha256(f"{version}:{glyphs}".encode()).hexdigest()
+    return f"CustomFont-{digest[:16]}", f"data:font/{options.flavor};base64,{data}"
+
+
+async def get_font_subset(path: Path, text: str) -> Tuple[str, str]:
+    glyphs = get_glyph_set(text)
+    version = get_file_version(path)
+    with metrics.time("render_stage_seconds", stage="font_subset"):
+        return await anyio.to_thread.run_sync(subset_font, str(path), version, glyphs)
+
+
+@lru_cache(maxsize=128)
+def read_data_uri(path: str, version: str) -> str:  # noqa: ARG001
+    data = base64.b64encode(Path(path).read_bytes()).decode()
+    return f"data:{get_asset_mime_type(Path(path))};base64,{data}"
+
+
+async def get_image_data_uri(path: Path) -> str:
+    version = get_file_version(path)
+    return await anyio.to_thread.run_sync(read_data_uri, str(path), version)
+
+
+async def get_inline_assets(image: str, font: str, text: str) -> Tuple[str, str, str]:
+    """
+    Replaces router urls of the sticker image and font with data uris,
+    returns image uri, font uri and font family name
+    """
+
+    family, font_uri = await get_font_subset(from_router_url(font), text)
+    image_uri = await get_image_data_uri(from_router_url(image))
+    return image_uri, font_uri, family
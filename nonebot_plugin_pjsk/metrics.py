@@ -0,0 +1,283 @@
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+)
+
+from nonebot import get_driver, logger
+from nonebot.drivers import URL, HTTPServerSetup, Request, Response, ReverseMixin
+
+from .config import config
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+Labels = Tuple[Tuple[str, str], ...]
+MetricKey = Tuple[str, Labels]
+TE = TypeVar("TE", bound=Type["MetricsExporter"])
+
+
+def make_labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Histogram:
+    """Count and sum of all observations, quantiles of the latest ones"""
+
+    def __init__(self, max_samples: int) -> None:
+        self.samples: Deque[float] = deque(maxlen=max(max_samples, 1))
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.samples.append(value)
+        self.count += 1
+        self.sum += value
+
+    def quantiles(self, qs: Sequence[float] = QUANTILES) -> List[float]:
+        if not self.samples:
+            return [math.nan for _ in qs]
+        samples = sorted(self.samples)
+        return [samples[min(int(q * len(samples)), len(samples) - 1)] for q in qs]
+
+
+class Metrics:
+    def __init__(self, enabled: bool, max_samples: int) -> None:
+        self.enabled = enabled
+        self.max_samples = max_samples
+        self.histograms: Dict[MetricKey, Histogram] = {}
+        self.counters: Dict[MetricKey, float] = {}
+        self.collectors: Dict[str, Callable[[], Dict[str, int]]] = {}
+
+    def observe(self, name: str, value: float, **labels: str):
+        if not self.enabled:
+            return
+        key = (name, make_labels(labels))
+        if not (histogram := self.histograms.get(key)):
+            histogram = self.histograms[key] = Histogram(self.max_samples)
+        histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels: str):
+        if not self.enabled:
+            return
+        key = (name, make_labels(labels))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    @contextmanager
+    def time(self, name: str, **labels: str) -> Iterator[None]:  # noqa: A003
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def register_collector(self, name: str, func: Callable[[], Dict[str, int]]):
+        """`func` is called on export, every returned item becomes a gauge"""
+        self.collectors[name] = func
+
+    def collect(self) -> Dict[str, float]:
+        gauges: Dict[str, float] = {}
+        for name, func in self.collectors.items():
+            try:
+                gauges.update({f"{name}_{k}": v for k, v in func().items()})
+            except Exception:
+                logger.exception(f"Error occurred while collecting metrics `{name}`")
+        return gauges
+
+    def hit_ratios(self) -> Dict[str, float]:
+        """hit ratio of `cache_requests_total` per cache kind"""
+
+        totals: Dict[str, List[float]] = {}
+        for (name, labels), value in self.counters.items():
+            if name != "cache_requests_total":
+                continue
+            label_dict = dict(labels)
+            hits_total = totals.setdefault(label_dict.get("kind", ""), [0, 0])
+            hits_total[1] += value
+            if label_dict.get("result") == "hit":
+                hits_total[0] += value
+        return {k: h / t for k, (h, t) in totals.items() if t}
+
+
+metrics = Metrics(
+    bool(config.pjsk_metrics_exporters),
+    config.pjsk_metrics_max_samples,
+)
+
+
+def format_labels(labels: Labels, **extra: str) -> str:
+    items = [*labels, *extra.items()]
+    if not items:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in items
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def format_prometheus(prefix: str = "pjsk_") -> str:
+    """all metrics in the Prometheus text exposition format"""
+
+    lines: List[str] = []
+    typed = set()
+
+    def add_type(name: str, metric_type: str):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {metric_type}")
+
+    for (name, labels), histogram in sorted(metrics.histograms.items()):
+        name = f"{prefix}{name}"
+        add_type(name, "summary")
+        for q, v in zip(QUANTILES, histogram.quantiles()):
+            lines.append(f"{name}{format_labels(labels, quantile=str(q))} {v}")
+        lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+        lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+    for (name, labels), value in sorted(metrics.counters.items()):
+        name = f"{prefix}{name}"
+        add_type(name, "counter")
+        lines.append(f"{name}{format_labels(labels)} {value}")
+
+    for kind, ratio in sorted(metrics.hit_ratios().items()):
+        name = f"{prefix}cache_hit_ratio"
+        add_type(name, "gauge")
+        lines.append(f"{name}{format_labels((), kind=kind)} {ratio}")
+
+    for name, value in sorted(metrics.collect().items()):
+        name = f"{prefix}{name}"
+        add_type(name, "gauge")
+        lines.append(f"{name} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+def format_summary() -> str:
+    """short human readable summary for logging"""
+
+    lines: List[str] = []
+    for (name, labels), histogram in sorted(metrics.histograms.items()):
+        p50, p95, p99 = (x * 1000 for x in histogram.quantiles())
+        lines.append(
+            f"{name}{format_labels(labels)}: count={histogram.count} "
+            f"p50={p50:.1f}ms p95={p95:.1f}ms p99={p99:.1f}ms",
+        )
+    for kind, ratio in sorted(metrics.hit_ratios().items()):
+        lines.append(f"cache_hit_ratio{{kind={kind}}}: {ratio:.1%}")
+    if gauges := metrics.collect():
+        lines.append(" ".join(f"{k}={v}" for k, v in sorted(gauges.items())))
+    return "\n".join(lines)
+
+
+class MetricsExporter:
+    """Exposes collected metrics somewhere, created on startup"""
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+EXPORTERS: Dict[str, Type[MetricsExporter]] = {}
+
+
+def register_exporter(name: str) -> Callable[[TE], TE]:
+    def decorator(cls: TE) -> TE:
+        EXPORTERS[name] = cls
+        return cls
+
+    return decorator
+
+
+@register_exporter("log")
+class LogExporter(MetricsExporter):
+    def __init__(self) -> None:
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(config.pjsk_metrics_log_interval)
+            if summary := format_summary():
+                logger.info(f"Render metrics:\n{summary}")
+
+    async def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+@register_exporter("prometheus")
+class PrometheusExporter(MetricsExporter):
+    def __init__(self) -> None:
+        driver = get_driver()
+        if not isinstance(driver, ReverseMixin):
+            logger.warning(
+                "Current driver does not serve HTTP, "
+                "Prometheus metrics exporter disabled",
+            )
+            return
+
+        async def handle(_: Request) -> Response:
+            return Response(
+                200,
+                headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+                content=format_prometheus(),
+            )
+
+        driver.setup_http_server(
+            HTTPServerSetup(
+                URL(config.pjsk_metrics_path),
+                "GET",
+                "pjsk_metrics",
+                handle,
+            ),
+        )
+
+
+def create_exporters() -> List[MetricsExporter]:
+    exporters: List[MetricsExporter] = []
+    for name in config.pjsk_metrics_exporters:
+        if not (cls := EXPORTERS.get(name)):
+            logger.warning(f"Unknown metrics exporter `{name}`")
+            continue
+        try:
+            exporters.append(cls())
+        except Exception:
+            logger.exception(f"Error occurred while creating metrics exporter `{name}`")
+    return exporters
+
+
+async def start_exporters():
+    # created on startup so exporters registered by other plugins are available
+    exporters.extend(create_exporters())
+    for exporter in exporters:
+        await exporter.start()
+
+
+async def stop_exporters():
+    for exporter in exporters:
+        await exporter.stop()
+    exporters.clear()
+
+
+exporters: List[MetricsExporter] = []
+
+driver = get_driver()
+driver.on_startup(start_exporters)
+driver.on_shutdown(stop_exporters)
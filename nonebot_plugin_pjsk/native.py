@@ -0,0 +1,205 @@
+import math
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+from typing import Any, List, Sequence, Tuple
+
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+
+@lru_cache(maxsize=64)
+def get_font(
+    path: str,
+    mtime_ns: int,  # noqa: ARG001
+    size: int,
+) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(path, size)
+
+
+@lru_cache(maxsize=32)
+def load_sticker_image(
+    path: str,
+    mtime_ns: int,  # noqa: ARG001
+    width: int,
+    height: int,
+) -> Image.Image:
+    """
+    Scale the image like svg `<image>` with the default
+    `preserveAspectRatio="xMidYMid meet"` does
+    """
+
+    with Image.open(path) as im:
+        im = im.convert("RGBA")
+    scale = min(width / im.width, height / im.height)
+    size = (max(round(im.width * scale), 1), max(round(im.height * scale), 1))
+    if size != im.size:
+        im = im.resize(size, Image.Resampling.LANCZOS)
+
+    canvas = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    canvas.paste(im, ((width - size[0]) // 2, (height - size[1]) // 2))
+    return canvas
+
+
+def parse_color(color: str) -> Tuple[int, ...]:
+    return ImageColor.getcolor(color, "RGBA")  # type: ignore
+
+
+def collapse_whitespace(line: str) -> str:
+    # svg text drops leading and trailing spaces and collapses the rest
+    return " ".join(line.split())
+
+
+def draw_sticker(
+    image_path: Path,
+    font_path: Path,
+    x: int,
+    y: int,
+    text: str,
+    font_color: str,
+    font_size: int,
+    rotate: float,
+    stroke_color: str,
+    stroke_width: int,
+    line_spacing: float,
+    width: int,
+    height: int,
+) -> Image.Image:
+    """Draw the same picture `sticker.svg.jinja` describes"""
+
+    canvas = load_sticker_image(
+        str(image_path),
+        image_path.stat().st_mtime_ns,
+        width,
+        height,
+    ).copy()
+
+    font = get_font(str(font_path), font_path.stat().st_mtime_ns, font_size)
+    fill = parse_color(font_color)
+    stroke_fill = parse_color(stroke_color)
+    # svg strokes are centered on the outline, only half of the width is outside,
+    # pillow draws the stroke under the fill, same as `paint-order="stroke"`
+    stroke = round(stroke_width / 2)
+    lines = [
+        (i * line_spacing * font_size, line)
+        for i, line in enumerate(collapse_whitespace(x) for x in text.splitlines())
+        if line
+    ]
+    if not lines:
+        return canvas
+
+    # svg does not clip text to the unrotated frame, so draw on a layer centered
+    # on the rotation origin that holds the text at any angle, then crop it
+    measure = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+    radius = 1
+    for dy, line in lines:
+        left, top, right, bottom = measure.textbbox(
+            (0, dy),
+            line,
+            font=font,
+            anchor="ms",
+            stroke_width=stroke,
+        )
+        radius = max(
+            radius,
+            *(
+                math.ceil(math.hypot(a, b)) + 1
+                for a in (left, right)
+                for b in (top, bottom)
+            ),
+        )
+
+    layer = Image.new("RGBA", (radius * 2, radius * 2), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(layer)
+    for dy, line in lines:
+        draw.text(
+            (radius, radius + dy),
+            line,
+            font=font,
+            fill=fill,
+            anchor="ms",
+            stroke_width=stroke,
+            stroke_fill=stroke_fill,
+        )
+
+    if rotate:
+        # svg rotates clockwise, pillow rotates counterclockwise
+        layer = layer.rotate(
+            -rotate,
+            resample=Image.Resampling.BICUBIC,
+            center=(radius, radius),
+        )
+
+    left, top = radius - x, radius - y
+    layer = layer.crop((left, top, left + width, top + height))
+    canvas.alpha_composite(layer)
+    return canvas
+
+
+def render_sticker(image_path: Path, font_path: Path, **kwargs: Any) -> bytes:
+    """`draw_sticker`, returns png bytes"""
+
+    buffer = BytesIO()
+    draw_sticker(image_path, font_path, **kwargs).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def encode_tile(im: Image.Image) -> bytes:
+    """png with light compression, tiles are written often and stay small"""
+
+    buffer = BytesIO()
+    im.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def decode_tile(data: bytes) -> Image.Image:
+    with Image.open(BytesIO(data)) as im:
+        return im.convert("RGBA")
+
+
+def compose_grid(
+    tiles: Sequence[Image.Image],
+    columns: int = 5,
+    padding: int = 14,
+    gap: int = 14,
+    background: str = "#282c34",
+) -> Image.Image:
+    """Lay tiles out like `sticker_grid.html.jinja` does"""
+
+    columns = max(min(columns, len(tiles)), 1)
+    rows = math.ceil(len(tiles) / columns)
+    tile_w = max((x.width for x in tiles), default=0)
+    tile_h = max((x.height for x in tiles), default=0)
+
+    canvas = Image.new(
+        "RGBA",
+        (
+            padding * 2 + tile_w * columns + gap * (columns - 1),
+            padding * 2 + tile_h * rows + gap * max(rows - 1, 0),
+        ),
+        parse_color(background),
+    )
+    for i, tile in enumerate(tiles):
+        row, column = divmod(i, columns)
+        canvas.alpha_composite(
+            tile,
+            (padding + column * (tile_w + gap), padding + row * (tile_h + gap)),
+        )
+    return canvas
+
+
+def slice_image(
+    data: bytes,
+    boxes: Sequence[Tuple[float, float, float, float]],
+) -> List[bytes]:
+    """Crop `(x, y, width, height)` boxes out of an image, returns png bytes"""
+
+    results: List[bytes] = []
+    with Image.open(BytesIO(data)) as im:
+        im = im.convert("RGBA")
+        for x, y, w, h in boxes:
+            left, top = round(x), round(y)
+            cropped = im.crop((left, top, left + round(w), top + round(h)))
+            buffer = BytesIO()
+            cropped.save(buffer, format="PNG")
+            results.append(buffer.getvalue())
+    return results
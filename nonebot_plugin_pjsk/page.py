@@ -0,0 +1,374 @@
+import asyncio
+import mimetypes
+import time
+from contextlib import asynccontextmanager, suppress
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Union
+
+import anyio
+from nonebot import get_driver, logger
+from nonebot_plugin_htmlrender import get_browser, get_new_page
+from playwright.async_api import Page, Request, Route
+from yarl import URL
+
+from .cache import MemoryCache
+from .config import config
+from .metrics import metrics
+from .resource import ASSET_UPDATE_HANDLERS, DATA_FOLDER, FONT_PATH, ensure_asset
+from .utils import SingleFlight, create_background_task
+
+ROUTER_BASE_URL = "https://pjsk.nonebot/"
+
+POOL_HEALTH_CHECK_TIMEOUT = 5
+
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+ASSET_MIME_TYPES = {
+    ".ttf": "font/ttf",
+    ".otf": "font/otf",
+    ".woff": "font/woff",
+    ".woff2": "font/woff2",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+}
+
+POOL_WARMUP_HTML = """
+<!DOCTYPE html>
+<html>
+  <head>
+    <meta charset="UTF-8" />
+    <style>
+      body {
+        margin: 0;
+      }
+    </style>
+  </head>
+  <body>
+    <div id="root"></div>
+  </body>
+</html>
+"""
+
+# load the font once so following renders can reuse it from memory
+POOL_WARMUP_SCRIPT = """
+async (fontUrl) => {
+  const font = new FontFace('CustomFont', `url('${fontUrl}')`);
+  document.fonts.add(font);
+  await font.load();
+  await document.fonts.ready;
+}
+"""
+
+# swap the svg in and wait until the image and font are ready to be painted
+POOL_RENDER_SCRIPT = """
+async (html) => {
+  const root = document.getElementById('root');
+  root.innerHTML = html;
+  // layout has to happen before the browser starts loading the fonts used
+  root.getBoundingClientRect();
+  await Promise.all(
+    [...root.querySelectorAll('text')].map((el) => {
+      const style = getComputedStyle(el);
+      return document.fonts
+        .load(`${style.fontSize} ${style.fontFamily}`, el.textContent)
+        .catch(() => {});
+    }),
+  );
+  await Promise.all(
+    [...root.querySelectorAll('image')].map(
+      (el) =>
+        new Promise((resolve) => {
+          const img = new Image();
+          img.onload = img.onerror = resolve;
+          img.src = el.getAttribute('href');
+        }),
+    ),
+  );
+  await document.fonts.ready;
+  await new Promise((resolve) =>
+    requestAnimationFrame(() => requestAnimationFrame(resolve)),
+  );
+}
+"""
+
+STICKER_BATCH_HTML = (
+    '<div id="batch" style="display: flex; flex-direction: column; '
+    'align-items: flex-start; width: max-content;">{}</div>'
+)
+
+# position of every sticker relative to the batch container
+STICKER_BATCH_BOXES_SCRIPT = """
+() => {
+  const batch = document.getElementById('batch');
+  const base = batch.getBoundingClientRect();
+  return [...batch.children].map((el) => {
+    const rect = el.getBoundingClientRect();
+    return [rect.x - base.x, rect.y - base.y, rect.width, rect.height];
+  });
+}
+"""
+
+
+async def root_router(route: Route):
+    return await route.fulfill(body="<html></html>")
+
+
+class AssetStore:
+    """Memoized bytes of the fonts and sticker images served to the pages"""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.memory = MemoryCache(max_bytes)
+        self.requests = 0
+        self.bytes_served = 0
+        self._flight: SingleFlight[bytes] = SingleFlight()
+
+    async def _read(self, path: Path) -> bytes:
+        await ensure_asset(path)
+        data = await anyio.Path(path).read_bytes()
+        self.memory.set(str(path), data)
+        return data
+
+    async def get(self, path: Path) -> bytes:
+        self.requests += 1
+        data = self.memory.get(str(path))
+        if data is None:
+            data = await self._flight.do(str(path), lambda: self._read(path))
+        self.bytes_served += len(data)
+        return data
+
+    def forget(self, path: Path):
+        self.memory.pop(str(path))
+
+    async def preload(self, *paths: Path):
+        await asyncio.gather(*(self._read(x) for x in paths))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "requests": self.requests,
+            "bytes_served": self.bytes_served,
+            **{f"memory_{k}": v for k, v in self.memory.stats().items()},
+        }
+
+
+asset_store = AssetStore(config.pjsk_asset_memory_max_bytes)
+ASSET_UPDATE_HANDLERS.append(asset_store.forget)
+metrics.register_collector("asset_store", asset_store.stats)
+
+
+def get_asset_mime_type(path: Path) -> str:
+    return (
+        ASSET_MIME_TYPES.get(path.suffix.lower())
+        or mimetypes.guess_type(path.name)[0]
+        or "application/octet-stream"
+    )
+
+
+async def file_router(route: Route, request: Request):
+    url = URL(request.url)
+    path = DATA_FOLDER / url.path[1:]
+    logger.debug(f"Requested `{url}`, resolved to `{path}`")
+    try:
+        with metrics.time("render_stage_seconds", stage="asset_serve"):
+            data = await asset_store.get(path)
+    except Exception:
+        logger.exception("Error while reading file")
+        return await route.abort()
+    return await route.fulfill(
+        body=data,
+        headers={
+            "Content-Type": get_asset_mime_type(path),
+            "Cache-Control": ASSET_CACHE_CONTROL,
+            "Access-Control-Allow-Origin": "*",
+        },
+    )
+
+
+def to_router_url(path: Union[str, Path]) -> str:
+    if not isinstance(path, Path):
+        path = Path(path)
+    url = f"{ROUTER_BASE_URL}{path.relative_to(DATA_FOLDER)}".replace("\\", "/")
+    logger.debug(f"to_router_url: {path} -> {url}")
+    return url
+
+
+def from_router_url(url: str) -> Path:
+    return DATA_FOLDER / URL(url).path[1:]
+
+
+async def setup_routed_page(page: Page):
+    await page.route(f"{ROUTER_BASE_URL}**/*", file_router)
+    await page.route(f"{ROUTER_BASE_URL}", root_router)
+    await page.goto(ROUTER_BASE_URL)
+
+
+@asynccontextmanager
+async def get_routed_page(initial_html: Optional[str] = None):
+    start = time.perf_counter()
+    async with get_new_page(device_scale_factor=1) as page:
+        await setup_routed_page(page)
+        metrics.observe(
+            "render_stage_seconds",
+            time.perf_counter() - start,
+            stage="page_acquire",
+        )
+        if initial_html:
+            with metrics.time("render_stage_seconds", stage="page_load"):
+                await page.set_content(initial_html)
+        yield page
+
+
+class PooledPage:
+    def __init__(self, page: Page) -> None:
+        self.page = page
+        self.renders = 0
+
+
+class PagePool:
+    """
+    Long-lived routed pages with the sticker font already loaded,
+    renders only need to swap the svg into `#root` and take a screenshot
+    """
+
+    def __init__(self, size: int, max_renders: int) -> None:
+        self.size = size
+        self.max_renders = max_renders
+        self._idle: List[PooledPage] = []
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # created in the running loop, on python 3.9 it binds to the loop
+        # of the thread when created, which is not the one the driver runs
+        if not self._semaphore:
+            self._semaphore = asyncio.Semaphore(max(self.size, 1))
+        return self._semaphore
+
+    async def _create(self) -> PooledPage:
+        browser = await get_browser()
+        page = await browser.new_page(device_scale_factor=1)
+        try:
+            await setup_routed_page(page)
+            await page.set_content(POOL_WARMUP_HTML)
+            await page.evaluate(POOL_WARMUP_SCRIPT, to_router_url(FONT_PATH))
+        except Exception:
+            with suppress(Exception):
+                await page.close()
+            raise
+        logger.debug("Created a new pooled page")
+        return PooledPage(page)
+
+    async def _discard(self, item: PooledPage):
+        logger.debug(f"Recycling pooled page after {item.renders} renders")
+        with suppress(Exception):
+            await item.page.close()
+
+    async def _is_healthy(self, item: PooledPage) -> bool:
+        if item.page.is_closed() or item.renders >= self.max_renders:
+            return False
+        try:
+            return await asyncio.wait_for(
+                item.page.evaluate("() => !!document.getElementById('root')"),
+                POOL_HEALTH_CHECK_TIMEOUT,
+            )
+        except Exception:
+            return False
+
+    async def _get(self) -> PooledPage:
+        while self._idle:
+            item = self._idle.pop()
+            if await self._is_healthy(item):
+                return item
+            await self._discard(item)
+        return await self._create()
+
+    async def warmup(self):
+        if not self.enabled:
+            return
+        count = self.size - len(self._idle)
+        results = await asyncio.gather(
+            *(self._create() for _ in range(count)),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                logger.opt(exception=result).error("Failed to warm up pooled page")
+            else:
+                self._idle.append(result)
+        logger.debug(f"Warmed up {len(self._idle)} pooled pages")
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        await asyncio.gather(*(self._discard(x) for x in idle))
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[Page]:
+        start = time.perf_counter()
+        async with self.semaphore:
+            item = await self._get()
+            metrics.observe(
+                "render_stage_seconds",
+                time.perf_counter() - start,
+                stage="page_acquire",
+            )
+            try:
+                yield item.page
+            except BaseException:
+                await self._discard(item)
+                raise
+            item.renders += 1
+            self._idle.append(item)
+
+
+page_pool = PagePool(config.pjsk_page_pool_size, config.pjsk_page_pool_max_renders)
+
+
+@asynccontextmanager
+async def get_sticker_page(html: str) -> AsyncIterator[Page]:
+    if not page_pool.enabled:
+        async with get_routed_page(html) as page:
+            yield page
+        return
+
+    async with page_pool.acquire() as page:
+        with metrics.time("render_stage_seconds", stage="page_load"):
+            await page.evaluate(POOL_RENDER_SCRIPT, html)
+        yield page
+
+
+def is_page_pool_used() -> bool:
+    """stickers are only rendered in this process' browser without workers"""
+    return (
+        page_pool.enabled
+        and config.pjsk_render_backend == "browser"
+        and config.pjsk_render_workers <= 0
+    )
+
+
+async def warmup_page_pool():
+    try:
+        await asset_store.preload(FONT_PATH)
+        await page_pool.warmup()
+    except Exception:
+        logger.exception("Error occurred while warming up page pool")
+
+
+async def start_warmup_page_pool():
+    # launching the browser takes a while, do not hold up the startup for it
+    if not is_page_pool_used():
+        return
+    create_background_task(warmup_page_pool())
+
+
+async def stop_page_pool():
+    # the warmup is cancelled and awaited before this, it can not add pages
+    await page_pool.close()
+
+
+driver = get_driver()
+driver.on_startup(start_warmup_page_pool)
+driver.on_shutdown(stop_page_pool)
@@ -1,29 +1,67 @@
 import asyncio
 import math
-from contextlib import asynccontextmanager
-from pathlib import Path
-from typing import Awaitable, Callable, Dict, List, Literal, Optional, TypedDict, Union
+from contextlib import suppress
+from functools import lru_cache
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Literal,
+    Optional,
+    Set,
+    Tuple,
+    TypedDict,
+    Union,
+)
 from typing_extensions import Concatenate, ParamSpec, Unpack
 
 import anyio
-from nonebot import logger
-from nonebot_plugin_htmlrender import get_new_page
-from playwright.async_api import Page, Request, Route
-from yarl import URL
+from nonebot import get_driver, logger
+from nonebot.compat import model_dump
+from playwright.async_api import Page
 
+from .cache import get_cache, wait_cache_cleaned, write_cache
 from .config import config
+from .encode import (
+    ImageEncoding,
+    ImageKind,
+    encode_image,
+    encode_pil_image,
+    get_image_encoding,
+)
+from .inline import get_inline_assets, is_inline_enabled
+from .metrics import metrics
+from .page import (
+    STICKER_BATCH_BOXES_SCRIPT,
+    STICKER_BATCH_HTML,
+    from_router_url,
+    get_routed_page,
+    get_sticker_page,
+    to_router_url,
+)
 from .resource import (
-    DATA_FOLDER,
     FONT_PATH,
-    JINJA_ENV,
-    LOADED_STICKER_INFO,
     RESOURCE_FOLDER,
     StickerInfo,
-    get_cache,
+    ensure_asset,
+    get_catalog,
+    get_file_version,
+    get_jinja_env,
+    get_template_version,
     make_cache_key,
-    write_cache,
 )
-from .utils import is_full_width, qor
+from .scheduler import Priority, priority_var, render_priority, render_scheduler
+from .utils import (
+    SingleFlight,
+    chunks,
+    create_background_task,
+    is_full_width,
+    qor,
+    with_semaphore,
+)
+from .worker import register_worker_job, render_workers
 
 P = ParamSpec("P")
 
@@ -33,63 +71,81 @@ DEFAULT_STROKE_WIDTH = 9
 DEFAULT_LINE_SPACING = 1.3
 DEFAULT_STROKE_COLOR = "#ffffff"
 
-ROUTER_BASE_URL = "https://pjsk.nonebot/"
+
+FONT_METRICS_SIZE = 256
+
+
+@lru_cache(maxsize=None)
+def get_font_char_advance(char: str, font_mtime_ns: int) -> float:
+    from .native import get_font
+
+    font = get_font(str(FONT_PATH), font_mtime_ns, FONT_METRICS_SIZE)
+    return font.getlength(char) / FONT_METRICS_SIZE
 
 
-def calc_approximate_text_width(text: str, size: int, rotate_deg: float) -> float:
+def get_font_mtime_ns() -> Optional[int]:
+    try:
+        return FONT_PATH.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def get_char_advance(char: str, font_mtime_ns: Optional[int]) -> float:
+    """advance width of the char in em, estimated when the font is missing"""
+    if font_mtime_ns is not None:
+        with suppress(OSError):
+            return get_font_char_advance(char, font_mtime_ns)
+    return 1 if is_full_width(char) else 0.5
+
+
+def calc_text_block_size(
+    text: str,
+    size: int,
+    rotate_deg: float,
+    line_spacing: float = DEFAULT_LINE_SPACING,
+    stroke_width: int = DEFAULT_STROKE_WIDTH,
+) -> Tuple[float, float]:
+    """bounding box size of the rotated text block, includes the stroke"""
+
+    lines = [" ".join(x.split()) for x in text.splitlines()] or [""]
+    # the metrics follow the font when it is replaced by a newer one
+    font_mtime_ns = get_font_mtime_ns()
+    ems = max(sum(get_char_advance(x, font_mtime_ns) for x in line) for line in lines)
+    width = ems * size + stroke_width
+    height = size * (1 + (len(lines) - 1) * line_spacing) + stroke_width
+
     rotate_rad = math.radians(rotate_deg)
-    width = sum((size if is_full_width(x) else size / 2) for x in text)
-    return abs(width * math.cos(rotate_rad)) + abs(size * math.sin(rotate_rad))
+    sin, cos = abs(math.sin(rotate_rad)), abs(math.cos(rotate_rad))
+    return width * cos + height * sin, width * sin + height * cos
 
 
 def auto_adjust_font_size(
     text: str,
     size: int,
     rotate_deg: float,
+    line_spacing: float = DEFAULT_LINE_SPACING,
+    stroke_width: int = DEFAULT_STROKE_WIDTH,
     width: int = DEFAULT_WIDTH,
+    height: int = DEFAULT_HEIGHT,
     min_size: int = 8,
     multiplier: float = 1.2,
 ) -> int:
-    while size > min_size:
-        if (calc_approximate_text_width(text, size, rotate_deg) * multiplier) <= width:
-            break
-        size -= 1
-    return size
-
-
-async def root_router(route: Route):
-    return await route.fulfill(body="<html></html>")
-
-
-async def file_router(route: Route, request: Request):
-    url = URL(request.url)
-    path = anyio.Path(DATA_FOLDER / url.path[1:])
-    logger.debug(f"Requested `{url}`, resolved to `{path}`")
-    try:
-        data = await path.read_bytes()
-    except Exception:
-        logger.exception("Error while reading file")
-        return await route.abort()
-    return await route.fulfill(body=data)
-
-
-def to_router_url(path: Union[str, Path]) -> str:
-    if not isinstance(path, Path):
-        path = Path(path)
-    url = f"{ROUTER_BASE_URL}{path.relative_to(DATA_FOLDER)}".replace("\\", "/")
-    logger.debug(f"to_router_url: {path} -> {url}")
-    return url
+    """largest size not greater than `size` that fits the text in the image"""
 
+    def fits(s: int) -> bool:
+        w, h = calc_text_block_size(text, s, rotate_deg, line_spacing, stroke_width)
+        return w * multiplier <= width and h * multiplier <= height
 
-@asynccontextmanager
-async def get_routed_page(initial_html: Optional[str] = None):
-    async with get_new_page(device_scale_factor=1) as page:
-        await page.route(f"{ROUTER_BASE_URL}**/*", file_router)
-        await page.route(f"{ROUTER_BASE_URL}", root_router)
-        await page.goto(ROUTER_BASE_URL)
-        if initial_html:
-            await page.set_content(initial_html)
-        yield page
+    low, high = min_size, size
+    if high <= low or fits(high):
+        return high
+    while low < high:
+        mid = (low + high + 1) // 2
+        if fits(mid):
+            low = mid
+        else:
+            high = mid - 1
+    return low
 
 
 async def capture_element(
@@ -97,30 +153,58 @@ async def capture_element(
     selector: str,
     image_type: Literal["png", "jpeg"] = "jpeg",
     omit_background: bool = False,
-    cache_key: Optional[str] = None,
+    quality: Optional[int] = None,
 ) -> bytes:
-    element = await page.wait_for_selector(selector)
+    with metrics.time("render_stage_seconds", stage="wait_for_selector"):
+        element = await page.wait_for_selector(selector)
     assert element
-    img = await element.screenshot(type=image_type, omit_background=omit_background)
-    if config.pjsk_use_cache and cache_key:
-        await write_cache(f"{cache_key}.{image_type}", img)
-    return img
+    with metrics.time("render_stage_seconds", stage="screenshot"):
+        return await element.screenshot(
+            type=image_type,
+            omit_background=omit_background,
+            quality=quality if image_type == "jpeg" else None,
+        )
 
 
-async def capture_sticker(html: str, cache_key: Optional[str] = None) -> bytes:
-    async with get_routed_page(html) as page:
+async def capture_sticker(html: str) -> bytes:
+    async with get_sticker_page(html) as page:
         return await capture_element(
             page,
             "svg",
             image_type="png",
             omit_background=True,
-            cache_key=cache_key,
         )
 
 
-async def capture_template(html: str, cache_key: Optional[str] = None) -> bytes:
+async def capture_sticker_batch(htmls: List[str]) -> List[bytes]:
+    """Render many stickers in one page with one screenshot, then slice it"""
+
+    async with get_sticker_page(STICKER_BATCH_HTML.format("".join(htmls))) as page:
+        img = await capture_element(
+            page,
+            "#batch",
+            image_type="png",
+            omit_background=True,
+        )
+        boxes: List[Tuple[float, float, float, float]] = await page.evaluate(
+            STICKER_BATCH_BOXES_SCRIPT,
+        )
+    from .native import slice_image
+
+    with metrics.time("render_stage_seconds", stage="slice"):
+        return await anyio.to_thread.run_sync(slice_image, img, boxes)
+
+
+async def capture_template(html: str, encoding: ImageEncoding) -> bytes:
     async with get_routed_page(html) as page:
-        return await capture_element(page, ".main-wrapper", cache_key=cache_key)
+        if not encoding.lossless:  # let the browser encode the jpeg directly
+            return await capture_element(
+                page,
+                ".main-wrapper",
+                quality=encoding.quality,
+            )
+        img = await capture_element(page, ".main-wrapper", image_type="png")
+    return await encode_image(img, encoding)
 
 
 class StickerRenderKwargs(TypedDict):
@@ -139,6 +223,19 @@ class StickerRenderKwargs(TypedDict):
     height: int
 
 
+async def capture_sticker_native(params: StickerRenderKwargs) -> bytes:
+    from .native import render_sticker as render_sticker_native
+
+    with metrics.time("render_stage_seconds", stage="native"):
+        return await anyio.to_thread.run_sync(
+            lambda: render_sticker_native(
+                image_path=from_router_url(params["image"]),
+                font_path=from_router_url(params["font"]),
+                **{k: v for k, v in params.items() if k not in ("image", "font")},
+            ),
+        )
+
+
 def make_sticker_render_kwargs(
     info: StickerInfo,
     text: Optional[str] = None,
@@ -155,8 +252,16 @@ def make_sticker_render_kwargs(
     default_text = info.default_text
     text = qor(text, default_text.text)
     rotate = qor(rotate, lambda: math.degrees(default_text.r / 10))
+    stroke_width = qor(stroke_width, DEFAULT_STROKE_WIDTH)
+    line_spacing = qor(line_spacing, DEFAULT_LINE_SPACING)
     font_size = (
-        auto_adjust_font_size(text, default_text.s, rotate)
+        auto_adjust_font_size(
+            text,
+            default_text.s,
+            rotate,
+            line_spacing=line_spacing,
+            stroke_width=stroke_width,
+        )
         if auto_adjust
         else qor(font_size, default_text.s)
     )
@@ -169,8 +274,8 @@ def make_sticker_render_kwargs(
         "font_size": font_size,
         "rotate": rotate,
         "stroke_color": qor(stroke_color, DEFAULT_STROKE_COLOR),
-        "stroke_width": qor(stroke_width, DEFAULT_STROKE_WIDTH),
-        "line_spacing": qor(line_spacing, DEFAULT_LINE_SPACING),
+        "stroke_width": stroke_width,
+        "line_spacing": line_spacing,
         "font": to_router_url(FONT_PATH),
         "width": DEFAULT_WIDTH,
         "height": DEFAULT_HEIGHT,
@@ -179,28 +284,158 @@ def make_sticker_render_kwargs(
 
 
 async def render_sticker_html(**kwargs: Unpack[StickerRenderKwargs]) -> str:
-    template = JINJA_ENV.get_template("sticker.svg.jinja")
-    return await template.render_async(id=hash(kwargs["image"]), **kwargs)
+    template = get_jinja_env().get_template("sticker.svg.jinja")
+    pattern_id = hash(kwargs["image"])
+    font_family = "CustomFont"
+    if is_inline_enabled():
+        kwargs["image"], kwargs["font"], font_family = await get_inline_assets(
+            kwargs["image"],
+            kwargs["font"],
+            kwargs["text"],
+        )
+    with metrics.time("render_stage_seconds", stage="template"):
+        return await template.render_async(
+            id=pattern_id,
+            font_family=font_family,
+            **kwargs,
+        )
 
 
 async def render_sticker_grid_html(items: List[str]) -> str:
-    template = JINJA_ENV.get_template("sticker_grid.html.jinja")
-    return await template.render_async(items=items)
+    template = get_jinja_env().get_template("sticker_grid.html.jinja")
+    with metrics.time("render_stage_seconds", stage="template"):
+        return await template.render_async(items=items)
 
 
 async def render_help_html(text: str) -> str:
-    template = JINJA_ENV.get_template("help.html.jinja")
-    return await template.render_async(text=text)
+    template = get_jinja_env().get_template("help.html.jinja")
+    with metrics.time("render_stage_seconds", stage="template"):
+        return await template.render_async(text=text)
+
+
+PendingSticker = Tuple[StickerRenderKwargs, "asyncio.Future[bytes]"]
+
+
+class StickerBatcher:
+    """
+    Collects stickers requested within a short window and renders them
+    together with `capture_sticker_batch`
+    """
+
+    def __init__(self, max_size: int, window: float) -> None:
+        self.max_size = max_size
+        self.window = window
+        self._pending: List[PendingSticker] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set["asyncio.Task[None]"] = set()
+
+    async def submit(self, params: StickerRenderKwargs) -> bytes:
+        loop = asyncio.get_running_loop()
+        future: "asyncio.Future[bytes]" = loop.create_future()
+        self._pending.append((params, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif not self._timer:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[PendingSticker]):
+        logger.debug(f"Rendering {len(batch)} stickers in one batch")
+        try:
+            htmls = [await render_sticker_html(**params) for params, _ in batch]
+            images = await capture_sticker_batch(htmls)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), img in zip(batch, images):
+            if not future.done():
+                future.set_result(img)
+
+
+sticker_batcher = StickerBatcher(
+    max(config.pjsk_sticker_batch_size, 1),
+    config.pjsk_sticker_batch_window,
+)
+
+render_flight: SingleFlight[bytes] = SingleFlight()
 
 
-def use_cache(cache_key: Union[str, Callable[P, str]], ext: Literal["png", "jpeg"]):
-    def decorator(func: Callable[Concatenate[str, P], Awaitable[bytes]]):
+def get_cache_filename(key: str, encoding: ImageEncoding) -> str:
+    return f"{make_cache_key(key, encoding)}.{encoding.ext}"
+
+
+async def read_render_cache(filename: str, kind: str) -> Optional[bytes]:
+    if config.pjsk_use_cache and (c := await get_cache(filename)):
+        logger.debug(f"Cache hit for `{filename}`")
+        metrics.inc("cache_requests_total", kind=kind, result="hit")
+        return c
+    metrics.inc("cache_requests_total", kind=kind, result="miss")
+    return None
+
+
+async def write_render_cache(filename: str, img: bytes, priority: Priority):
+    if config.pjsk_use_cache:
+        # background renders should not push hot images out of memory
+        await write_cache(filename, img, memory=priority < Priority.BACKGROUND)
+
+
+def use_cache(
+    cache_key: Union[str, Callable[P, str]],
+    image_kind: ImageKind,
+    priority: Priority = Priority.INTERACTIVE,
+    prepare: Optional[Callable[P, Awaitable[Any]]] = None,
+):
+    """
+    `prepare` runs before the cache key is computed,
+    e.g. to fetch the assets the key depends on
+    """
+
+    def decorator(func: Callable[Concatenate[ImageEncoding, P], Awaitable[bytes]]):
+        kind = func.__name__.removeprefix("get_")
+
+        async def render(
+            filename: str,
+            encoding: ImageEncoding,
+            current_priority: Priority,
+            *args: P.args,
+            **kwargs: P.kwargs,
+        ) -> bytes:
+            async with render_scheduler.slot(current_priority, filename):
+                with metrics.time("render_seconds", kind=kind):
+                    img = await func(encoding, *args, **kwargs)
+            await write_render_cache(filename, img, current_priority)
+            return img
+
         async def wrapper(*args: P.args, **kwargs: P.kwargs):
+            if prepare:
+                await prepare(*args, **kwargs)
             key = cache_key(*args, **kwargs) if callable(cache_key) else cache_key
-            if (config.pjsk_use_cache) and (c := await get_cache(f"{key}.{ext}")):
-                logger.debug(f"Cache hit for `{key}.{ext}`")
+            encoding = get_image_encoding(image_kind)
+            filename = get_cache_filename(key, encoding)
+            if (c := await read_render_cache(filename, kind)) is not None:
                 return c
-            return await func(key, *args, **kwargs)
+            render_scheduler.check_rate_limit()
+            current_priority = qor(priority_var.get(), priority)
+            if filename in render_flight:
+                # do not wait behind the priority of whoever started the render
+                render_scheduler.promote(filename, current_priority)
+            return await render_flight.do(
+                filename,
+                lambda: render(filename, encoding, current_priority, *args, **kwargs),
+            )
 
         return wrapper
 
@@ -208,59 +443,339 @@ def use_cache(cache_key: Union[str, Callable[P, str]], ext: Literal["png", "jpeg
 
 
 def get_sticker_cache_key_maker(**params: Unpack[StickerRenderKwargs]) -> str:
-    return make_cache_key(params)
+    return make_cache_key(
+        params,
+        get_file_version(from_router_url(params["image"])),
+        get_file_version(from_router_url(params["font"])),
+        get_template_version("sticker.svg.jinja"),
+        config.pjsk_render_backend,
+    )
 
 
-@use_cache(get_sticker_cache_key_maker, "png")
-async def get_sticker(key: str, **params: Unpack[StickerRenderKwargs]) -> bytes:
-    return await capture_sticker(await render_sticker_html(**params), cache_key=key)
+def get_grid_cache_key(obj: Any) -> str:
+    return make_cache_key(
+        obj,
+        get_file_version(FONT_PATH),
+        get_template_version("sticker.svg.jinja"),
+        get_template_version("sticker_grid.html.jinja"),
+        config.pjsk_grid_backend,
+    )
 
 
-@use_cache("help", "jpeg")
-async def get_help(key: str, text: str) -> bytes:
-    return await capture_template(await render_help_html(text), cache_key=key)
+def get_help_cache_key_maker(text: str) -> str:
+    return make_cache_key(text, get_template_version("help.html.jinja"))
 
 
-@use_cache("all_characters", "jpeg")
-async def get_all_characters_grid(key: str) -> bytes:
+def get_grid_stickers_cache_obj(infos: Dict[str, StickerInfo]) -> Any:
+    return [
+        [text, model_dump(info), get_file_version(RESOURCE_FOLDER / info.img)]
+        for text, info in infos.items()
+    ]
+
+
+def get_all_characters_grid_stickers() -> Dict[str, StickerInfo]:
     character_dict: Dict[str, StickerInfo] = {}
-    for info in LOADED_STICKER_INFO:
-        character = info.character
-        if character not in character_dict:
-            character = (
-                character
-                if character[0].isupper()
-                else character[0].upper() + character[1:]
+    for stickers in get_catalog().by_character.values():
+        character = stickers[0].character
+        character = (
+            character
+            if character[0].isupper()
+            else character[0].upper() + character[1:]
+        )
+        character_dict[character] = stickers[0]
+    return character_dict
+
+
+def get_character_stickers_grid_stickers(character: str) -> Dict[str, StickerInfo]:
+    return {
+        info.sticker_id: info
+        for info in get_catalog().get_character_stickers(character)
+    }
+
+
+def get_all_characters_grid_cache_key_maker() -> str:
+    return get_grid_cache_key(
+        get_grid_stickers_cache_obj(get_all_characters_grid_stickers()),
+    )
+
+
+async def render_sticker_png(params: StickerRenderKwargs) -> bytes:
+    if config.pjsk_render_backend == "native":
+        try:
+            return await capture_sticker_native(params)
+        except Exception:
+            logger.exception("Native renderer failed, falling back to browser")
+    if sticker_batcher.window > 0:
+        return await sticker_batcher.submit(params)
+    return await capture_sticker(await render_sticker_html(**params))
+
+
+async def ensure_sticker_image(**params: Unpack[StickerRenderKwargs]):
+    await ensure_asset(from_router_url(params["image"]))
+
+
+@register_worker_job("sticker")
+async def render_sticker(params: StickerRenderKwargs, encoding: ImageEncoding) -> bytes:
+    return await encode_image(await render_sticker_png(params), encoding)
+
+
+@use_cache(get_sticker_cache_key_maker, "sticker", prepare=ensure_sticker_image)
+async def get_sticker(
+    encoding: ImageEncoding,
+    **params: Unpack[StickerRenderKwargs],
+) -> bytes:
+    return await render_workers.run("sticker", params, encoding)
+
+
+async def get_stickers(params_list: List[StickerRenderKwargs]) -> List[bytes]:
+    """
+    Like `get_sticker` for many stickers at once, the browser renders the
+    cache misses in batches of `PJSK_STICKER_BATCH_SIZE`, one screenshot each
+    """
+
+    # nothing to batch without screenshots, and workers take one sticker per job
+    if config.pjsk_render_backend == "native" or render_workers.available():
+        return list(await asyncio.gather(*(get_sticker(**x) for x in params_list)))
+
+    await asyncio.gather(*(ensure_sticker_image(**x) for x in params_list))
+    encoding = get_image_encoding("sticker")
+    filenames = [
+        get_cache_filename(get_sticker_cache_key_maker(**x), encoding)
+        for x in params_list
+    ]
+    results: Dict[str, bytes] = {}
+    for filename in set(filenames):
+        if (c := await read_render_cache(filename, "sticker")) is not None:
+            results[filename] = c
+
+    missing = {k: v for k, v in zip(filenames, params_list) if k not in results}
+    if missing:
+        render_scheduler.check_rate_limit()
+    priority = qor(priority_var.get(), Priority.INTERACTIVE)
+
+    async def render_batch(batch: List[StickerRenderKwargs]) -> List[bytes]:
+        if not batch:
+            return []
+        htmls = [await render_sticker_html(**x) for x in batch]
+        async with render_scheduler.slot(priority):
+            with metrics.time("render_seconds", kind="sticker_batch"):
+                images = await capture_sticker_batch(htmls)
+        return [await encode_image(x, encoding) for x in images]
+
+    async def render(
+        filename: str,
+        batch_task: "asyncio.Task[List[bytes]]",
+        index: int,
+    ) -> bytes:
+        img = (await batch_task)[index]
+        await write_render_cache(filename, img, priority)
+        return img
+
+    for batch in chunks(list(missing.items()), max(config.pjsk_sticker_batch_size, 1)):
+        # stickers already rendering are left to their own renders
+        own = [(k, v) for k, v in batch if k not in render_flight]
+        indexes = {k: i for i, (k, _) in enumerate(own)}
+        batch_task = asyncio.create_task(render_batch([v for _, v in own]))
+        try:
+            # every sticker is a flight of its own, so single renders join the batch
+            images = await asyncio.gather(
+                *(
+                    (
+                        render_flight.do(
+                            k,
+                            lambda k=k: render(k, batch_task, indexes[k]),
+                        )
+                        if k in indexes
+                        else get_sticker(**v)
+                    )
+                    for k, v in batch
+                ),
             )
-            character_dict[character] = info
+        finally:
+            if not batch_task.done():
+                batch_task.cancel()
+        results.update(zip((k for k, _ in batch), images))
+
+    return [results[x] for x in filenames]
+
+
+@register_worker_job("help")
+async def render_help(text: str, encoding: ImageEncoding) -> bytes:
+    return await capture_template(await render_help_html(text), encoding)
+
+
+@use_cache(get_help_cache_key_maker, "grid")
+async def get_help(encoding: ImageEncoding, text: str) -> bytes:
+    return await render_workers.run("help", text, encoding)
+
+
+def get_grid_tile_filename(params: StickerRenderKwargs) -> str:
+    key = make_cache_key(
+        params,
+        get_file_version(from_router_url(params["image"])),
+        get_file_version(from_router_url(params["font"])),
+        "native",
+    )
+    return f"{key}.tile.png"
+
+
+async def compose_stickers_grid(
+    params_list: List[StickerRenderKwargs],
+    encoding: ImageEncoding,
+) -> bytes:
+    """
+    Tile natively drawn stickers into a grid image, the tiles are kept in
+    the render cache so later grids with the same stickers only compose
+    """
+
+    from .native import compose_grid, decode_tile, draw_sticker, encode_tile
+
+    filenames = [get_grid_tile_filename(x) for x in params_list]
+    cached: List[Optional[bytes]] = [None] * len(filenames)
+    if config.pjsk_use_cache:
+        # tiles are only read when a grid misses, keep them out of memory
+        cached = list(
+            await asyncio.gather(*(get_cache(x, memory=False) for x in filenames)),
+        )
+
+    def compose() -> Tuple[bytes, Dict[str, bytes]]:
+        tiles = []
+        drawn: Dict[str, bytes] = {}
+        for params, filename, data in zip(params_list, filenames, cached):
+            if data is not None:
+                tiles.append(decode_tile(data))
+                continue
+            tile = draw_sticker(
+                from_router_url(params["image"]),
+                from_router_url(params["font"]),
+                **{k: v for k, v in params.items() if k not in ("image", "font")},
+            )
+            drawn[filename] = encode_tile(tile)
+            tiles.append(tile)
+        return encode_pil_image(compose_grid(tiles), encoding), drawn
+
+    with metrics.time("render_stage_seconds", stage="compose_grid"):
+        img, drawn = await anyio.to_thread.run_sync(compose)
+    if config.pjsk_use_cache:
+        for filename, data in drawn.items():
+            await write_cache(filename, data, memory=False)
+    return img
+
+
+@register_worker_job("grid")
+async def render_stickers_grid(
+    params_list: List[StickerRenderKwargs],
+    encoding: ImageEncoding,
+) -> bytes:
+    if config.pjsk_grid_backend == "native":
+        try:
+            return await compose_stickers_grid(params_list, encoding)
+        except Exception:
+            logger.exception("Native grid composition failed, falling back to browser")
 
     sticker_templates = await asyncio.gather(
-        *(
-            render_sticker_html(**make_sticker_render_kwargs(info, char))
-            for char, info in character_dict.items()
-        ),
+        *(render_sticker_html(**x) for x in params_list),
     )
     return await capture_template(
         await render_sticker_grid_html(sticker_templates),
-        cache_key=key,
+        encoding,
     )
 
 
-def get_character_stickers_grid_cache_key_maker(character: str) -> str:
-    return character
+async def capture_stickers_grid(
+    infos: Dict[str, StickerInfo],
+    encoding: ImageEncoding,
+) -> bytes:
+    params_list = [
+        make_sticker_render_kwargs(info, text) for text, info in infos.items()
+    ]
+    return await render_workers.run("grid", params_list, encoding)
 
 
-@use_cache(get_character_stickers_grid_cache_key_maker, "jpeg")
-async def get_character_stickers_grid(key: str, character: str) -> bytes:
-    character = character.lower()
-    sticker_templates = await asyncio.gather(
-        *(
-            render_sticker_html(**make_sticker_render_kwargs(info, info.sticker_id))
-            for info in LOADED_STICKER_INFO
-            if info.character.lower() == character
-        ),
+async def ensure_grid_images(infos: Dict[str, StickerInfo]):
+    await asyncio.gather(
+        *(ensure_asset(RESOURCE_FOLDER / x.img) for x in infos.values()),
     )
-    return await capture_template(
-        await render_sticker_grid_html(sticker_templates),
-        cache_key=key,
+
+
+async def ensure_all_characters_grid_images():
+    await ensure_grid_images(get_all_characters_grid_stickers())
+
+
+async def ensure_character_stickers_grid_images(character: str):
+    await ensure_grid_images(get_character_stickers_grid_stickers(character))
+
+
+@use_cache(
+    get_all_characters_grid_cache_key_maker,
+    "grid",
+    Priority.GRID,
+    prepare=ensure_all_characters_grid_images,
+)
+async def get_all_characters_grid(encoding: ImageEncoding) -> bytes:
+    return await capture_stickers_grid(get_all_characters_grid_stickers(), encoding)
+
+
+def get_character_stickers_grid_cache_key_maker(character: str) -> str:
+    return get_grid_cache_key(
+        get_grid_stickers_cache_obj(get_character_stickers_grid_stickers(character)),
+    )
+
+
+@use_cache(
+    get_character_stickers_grid_cache_key_maker,
+    "grid",
+    Priority.GRID,
+    prepare=ensure_character_stickers_grid_images,
+)
+async def get_character_stickers_grid(
+    encoding: ImageEncoding,
+    character: str,
+) -> bytes:
+    return await capture_stickers_grid(
+        get_character_stickers_grid_stickers(character),
+        encoding,
     )
+
+
+async def prerender_grids():
+    """
+    Render the overview grid and every character grid into cache,
+    grids whose stickers did not change are cache hits and get skipped
+    """
+
+    if not config.pjsk_use_cache:
+        return
+    # grids rendered before `PJSK_CLEAR_CACHE` finished would be removed again
+    await wait_cache_cleaned()
+
+    semaphore = asyncio.Semaphore(max(config.pjsk_prerender_concurrency, 1))
+
+    @with_semaphore(semaphore)
+    async def render(name: str, func: Callable[[], Awaitable[bytes]]):
+        try:
+            await func()
+        except Exception:
+            logger.exception(f"Error occurred while pre-rendering grid `{name}`")
+
+    characters = list(get_catalog().by_character)
+    logger.debug(f"Pre-rendering grids of {len(characters)} characters")
+    with render_priority(Priority.BACKGROUND):
+        await asyncio.gather(
+            render("all_characters", get_all_characters_grid),
+            *(
+                render(x, lambda x=x: get_character_stickers_grid(x))
+                for x in sorted(characters)
+            ),
+        )
+    logger.debug("Finished pre-rendering grids")
+
+
+async def start_prerender_grids():
+    if not config.pjsk_prerender_grids:
+        return
+    create_background_task(prerender_grids())
+
+
+driver = get_driver()
+driver.on_startup(start_prerender_grids)
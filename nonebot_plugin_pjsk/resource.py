@@ -1,73 +1,100 @@
 import asyncio
+import difflib
+import hashlib
 import json
 import random
-from contextlib import suppress
-from pathlib import Path
-from typing import Any, Coroutine, List, Optional, overload
+import tarfile
+import zipfile
+from functools import lru_cache
+from pathlib import Path, PurePosixPath
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Coroutine,
+    Dict,
+    List,
+    Optional,
+    Set,
+    overload,
+)
 
 import anyio
-import jinja2
 from nonebot import get_driver, logger
-from nonebot.compat import type_validate_json
+from nonebot.compat import model_dump, type_validate_json
 from pydantic import BaseModel, Field
 
 from .config import config
-from .utils import ResponseType, append_prefix, async_request, with_semaphore
+from .utils import (
+    ResponseType,
+    SingleFlight,
+    append_prefix,
+    async_request,
+    close_client,
+    create_background_task,
+    get_client,
+    with_semaphore,
+)
+
+if TYPE_CHECKING:
+    import jinja2
+    from httpx import Response
 
 DATA_FOLDER = Path.cwd() / "data" / "pjsk"
 FONT_FOLDER = DATA_FOLDER / "fonts"
 RESOURCE_FOLDER = DATA_FOLDER / "resource"
 STICKER_INFO_CACHE = DATA_FOLDER / "characters.json"
+ASSET_MANIFEST_PATH = DATA_FOLDER / "manifest.json"
 
 CACHE_FOLDER = DATA_FOLDER / "cache"
-if not CACHE_FOLDER.exists():
-    CACHE_FOLDER.mkdir(parents=True)
-else:
-    [
-        x.unlink()
-        for x in (
-            CACHE_FOLDER.iterdir()
-            if config.pjsk_clear_cache
-            else CACHE_FOLDER.glob("*.jpeg")
-        )
-    ]
 
 FONT_PATH = FONT_FOLDER / "YurukaFangTang.ttf"
 
-for _folder in (DATA_FOLDER, FONT_FOLDER, RESOURCE_FOLDER):
-    if not _folder.exists():
-        _folder.mkdir(parents=True)
-
 TEMPLATES_FOLDER = Path(__file__).parent / "templates"
-JINJA_ENV = jinja2.Environment(
-    loader=jinja2.FileSystemLoader(TEMPLATES_FOLDER),
-    autoescape=jinja2.select_autoescape(["html", "xml"]),
-    enable_async=True,
-)
 
 
-def make_cache_key(obj: Any) -> str:
-    with suppress(Exception):
-        return str(hash(obj))
-    return str(hash(json.dumps(obj)))
+@lru_cache(maxsize=None)
+def get_jinja_env() -> "jinja2.Environment":
+    import jinja2
+
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(TEMPLATES_FOLDER),
+        autoescape=jinja2.select_autoescape(["html", "xml"]),
+        enable_async=True,
+    )
 
 
-async def get_cache(filename: str) -> Optional[bytes]:
-    path = anyio.Path(CACHE_FOLDER / filename)
-    if await path.exists():
-        try:
-            return await path.read_bytes()
-        except Exception:
-            logger.exception("Error while reading cache")
-    return None
+def make_cache_key(obj: Any, *versions: str) -> str:
+    data = json.dumps(
+        [obj, *versions],
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(data.encode("u8")).hexdigest()
 
 
-async def write_cache(filename: str, data: bytes):
-    path = anyio.Path(CACHE_FOLDER / filename)
+@lru_cache(maxsize=1024)
+def _get_file_digest(path: Path, size: int, mtime_ns: int) -> str:  # noqa: ARG001
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        while chunk := f.read(65536):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_file_version(path: Path) -> str:
+    """content digest of the file, recomputed only when its size or mtime changes"""
     try:
-        await path.write_bytes(data)
-    except Exception:
-        logger.exception("Error while writing cache")
+        stat = path.stat()
+    except FileNotFoundError:
+        return ""
+    return _get_file_digest(path, stat.st_size, stat.st_mtime_ns)
+
+
+def get_template_version(name: str) -> str:
+    return get_file_version(TEMPLATES_FOLDER / name)
 
 
 class StickerText(BaseModel):
@@ -87,13 +114,96 @@ class StickerInfo(BaseModel):
     default_text: StickerText = Field(..., alias="defaultText")
 
 
-LOADED_STICKER_INFO: List[StickerInfo] = []
+RESOLVE_CACHE_SIZE = 256
+
+
+def normalize_character_name(name: str) -> str:
+    return "".join(name.split()).casefold()
+
+
+class StickerCatalog:
+    """Loaded stickers with indexes by id and by normalized character name"""
+
+    def __init__(
+        self,
+        stickers: List[StickerInfo],
+        aliases: Optional[Dict[str, str]] = None,
+    ) -> None:
+        stickers = sorted(stickers, key=lambda x: x.character.lower())
+        for i, x in enumerate(stickers, 1):
+            x.sticker_id = str(i)
+
+        self.stickers = stickers
+        self.by_id: Dict[str, StickerInfo] = {x.sticker_id: x for x in stickers}
+        self.by_character: Dict[str, List[StickerInfo]] = {}
+        for x in stickers:
+            self.by_character.setdefault(
+                normalize_character_name(x.character),
+                [],
+            ).append(x)
+
+        self.aliases: Dict[str, str] = {}
+        for alias, character in (aliases or {}).items():
+            character = normalize_character_name(character)
+            if character in self.by_character:
+                self.aliases[normalize_character_name(alias)] = character
+
+        # per catalog, so a replaced catalog does not stay alive through it
+        self._resolved: Dict[str, Optional[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.stickers)
+
+    def get(self, sticker_id: str) -> Optional[StickerInfo]:
+        return self.by_id.get(sticker_id)
+
+    def random(self) -> StickerInfo:
+        return random.choice(self.stickers)
+
+    def resolve_character(self, name: str) -> Optional[str]:
+        """
+        Resolves user input to a normalized character name,
+        tries exact name, alias, unique prefix, then closest match
+        """
+
+        try:
+            return self._resolved[name]
+        except KeyError:
+            pass
+        result = self._resolve_character(name)
+        if len(self._resolved) < RESOLVE_CACHE_SIZE:
+            self._resolved[name] = result
+        return result
+
+    def _resolve_character(self, name: str) -> Optional[str]:
+        name = normalize_character_name(name)
+        if not name:
+            return None
+        if name in self.by_character:
+            return name
+        if name in self.aliases:
+            return self.aliases[name]
+
+        candidates = [*self.by_character, *self.aliases]
+        prefixed = {self.aliases.get(x, x) for x in candidates if x.startswith(name)}
+        if len(prefixed) == 1:
+            return prefixed.pop()
+
+        if matches := difflib.get_close_matches(name, candidates, n=1, cutoff=0.6):
+            return self.aliases.get(matches[0], matches[0])
+        return None
+
+    def get_character_stickers(self, name: str) -> List[StickerInfo]:
+        character = self.resolve_character(name)
+        return self.by_character[character] if character else []
+
+
+# replaced as a whole on reload, never mutated, so readers always see one version
+sticker_catalog = StickerCatalog([])
 
 
-def sort_stickers():
-    LOADED_STICKER_INFO.sort(key=lambda x: x.character.lower())
-    for i, x in enumerate(LOADED_STICKER_INFO, 1):
-        x.sticker_id = str(i)
+def get_catalog() -> StickerCatalog:
+    return sticker_catalog
 
 
 @overload
@@ -107,50 +217,185 @@ def select_or_get_random(sticker_id: str) -> Optional[StickerInfo]:
 
 
 def select_or_get_random(sticker_id: Optional[str] = None) -> Optional[StickerInfo]:
-    return (
-        next((x for x in LOADED_STICKER_INFO if sticker_id == x.sticker_id), None)
-        if sticker_id
-        else random.choice(LOADED_STICKER_INFO)
+    catalog = get_catalog()
+    return catalog.get(sticker_id) if sticker_id else catalog.random()
+
+
+class AssetRecord(BaseModel):
+    sha256: str
+    size: int
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+class AssetManifest:
+    """
+    Validators and content digests of downloaded assets,
+    keyed by their path relative to `DATA_FOLDER`
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.records: Dict[str, AssetRecord] = {}
+
+    @staticmethod
+    def make_key(path: Path) -> str:
+        return path.relative_to(DATA_FOLDER).as_posix()
+
+    def load(self):
+        if not self.path.exists():
+            return
+        try:
+            self.records = type_validate_json(
+                Dict[str, AssetRecord],
+                self.path.read_text(encoding="u8"),
+            )
+        except Exception as e:
+            logger.warning(f"Failed to load asset manifest, ignoring it: {e!r}")
+            self.records = {}
+
+    async def save(self):
+        data = json.dumps(
+            {k: model_dump(v) for k, v in self.records.items()},
+            ensure_ascii=False,
+            indent=2,
+        )
+        tmp_path = anyio.Path(self.path.with_name(f"{self.path.name}.tmp"))
+        await tmp_path.write_text(data, encoding="u8")
+        await tmp_path.replace(self.path)
+
+    def get(self, path: Path) -> Optional[AssetRecord]:
+        return self.records.get(self.make_key(path))
+
+    def update(self, path: Path, data: bytes, response: Optional["Response"] = None):
+        self.records[self.make_key(path)] = AssetRecord(
+            sha256=hashlib.sha256(data).hexdigest(),
+            size=len(data),
+            etag=response.headers.get("ETag") if response else None,
+            last_modified=response.headers.get("Last-Modified") if response else None,
+        )
+
+    def has_validators(self, path: Path) -> bool:
+        record = self.get(path)
+        return bool(record and (record.etag or record.last_modified))
+
+    def update_validators(self, path: Path, response: "Response"):
+        if record := self.get(path):
+            record.etag = response.headers.get("ETag")
+            record.last_modified = response.headers.get("Last-Modified")
+
+    def make_conditional_headers(self, path: Path) -> Dict[str, str]:
+        headers: Dict[str, str] = {}
+        if record := self.get(path):
+            if record.etag:
+                headers["If-None-Match"] = record.etag
+            if record.last_modified:
+                headers["If-Modified-Since"] = record.last_modified
+        return headers
+
+
+asset_manifest = AssetManifest(ASSET_MANIFEST_PATH)
+
+# called with the path of every asset written to disk,
+# so in-memory copies of the old content can be dropped
+ASSET_UPDATE_HANDLERS: List[Callable[[Path], Any]] = []
+
+# assets written since the plugin started, no need to revalidate them again
+fetched_assets: Set[Path] = set()
+
+
+def verify_asset_sync(path: Path) -> bool:
+    """checks the file against its manifest record to catch truncated downloads"""
+
+    if not path.is_file():
+        return False
+
+    data = path.read_bytes()
+    record = asset_manifest.get(path)
+    if not record:
+        # downloaded before the manifest existed, trust and track it from now on
+        asset_manifest.update(path, data)
+        return True
+    return len(data) == record.size and (
+        hashlib.sha256(data).hexdigest() == record.sha256
     )
 
 
-async def check_and_download_font():
-    async def download(font_name: str):
-        logger.opt(colors=True).info(f"Downloading font <y>{font_name}</y>")
+async def verify_asset(path: Path) -> bool:
+    return await anyio.to_thread.run_sync(verify_asset_sync, path)
+
+
+async def write_asset(path: Path, data: bytes, response: Optional["Response"] = None):
+    apath = anyio.Path(path)
+    await apath.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = apath.with_name(f"{apath.name}.tmp")
+    await tmp_path.write_bytes(data)
+    await tmp_path.replace(apath)
+
+    asset_manifest.update(path, data, response)
+    fetched_assets.add(path)
+    for handler in ASSET_UPDATE_HANDLERS:
+        handler(path)
+
+
+async def fetch_asset(path: Path, urls: List[str], conditional: bool = False) -> bool:
+    """downloads the asset, returns `False` when server says it is not modified"""
+
+    headers = asset_manifest.make_conditional_headers(path) if conditional else None
+    response = await async_request(
+        *urls,
+        response_type=ResponseType.RESPONSE,
+        headers=headers,
+    )
+    if response.status_code == 304:
+        return False
+    await write_asset(path, response.content, response)
+    return True
+
 
-        path = anyio.Path(FONT_FOLDER) / font_name
-        urls = append_prefix(f"fonts/{font_name}", config.pjsk_repo_prefix)
-        await path.write_bytes(await async_request(*urls))
+def get_font_urls() -> List[str]:
+    return append_prefix(f"fonts/{FONT_PATH.name}", config.pjsk_repo_prefix)
 
-        logger.opt(colors=True).info(f"Successfully downloaded font <y>{font_name}</y>")
 
-    # tasks: List[Coroutine] = [
-    #     download(path.name) for path in FONT_PATHS if not path.exists()
-    # ]
-    # await asyncio.gather(*tasks)
-    if not FONT_PATH.exists():
-        await download(FONT_PATH.name)
+def get_sticker_urls(path_str: str) -> List[str]:
+    return append_prefix(f"public/img/{path_str}", config.pjsk_assets_prefix)
+
+
+async def check_and_download_font():
+    if await verify_asset(FONT_PATH):
+        return
+
+    font_name = FONT_PATH.name
+    logger.opt(colors=True).info(f"Downloading font <y>{font_name}</y>")
+    await fetch_asset(FONT_PATH, get_font_urls())
+    logger.opt(colors=True).info(f"Successfully downloaded font <y>{font_name}</y>")
 
 
 async def load_sticker_info():
     logger.debug("Updating sticker information")
 
-    path = anyio.Path(STICKER_INFO_CACHE)
+    path = STICKER_INFO_CACHE
     urls = append_prefix("src/characters.json", config.pjsk_assets_prefix)
     try:
-        loaded_text = await async_request(*urls, response_type=ResponseType.TEXT)
-        await path.write_text(loaded_text, encoding="u8")
+        if not await fetch_asset(path, urls, conditional=await verify_asset(path)):
+            logger.debug("Sticker information not modified")
     except Exception as e:
-        if not (await path.exists()):
+        if not path.exists():
             raise
         logger.warning(
             f"Failed to download sticker information, using cached data: {e!r}",
         )
-        loaded_text = await path.read_text(encoding="u8")
+    loaded_text = await anyio.Path(path).read_text(encoding="u8")
+
+    global sticker_catalog
+    sticker_catalog = StickerCatalog(
+        type_validate_json(List[StickerInfo], loaded_text),
+        config.pjsk_character_aliases,
+    )
+
 
-    LOADED_STICKER_INFO.clear()
-    LOADED_STICKER_INFO.extend(type_validate_json(List[StickerInfo], loaded_text))
-    sort_stickers()
+def get_sticker_image_paths() -> List[str]:
+    return sorted({x.img for x in get_catalog().stickers})
 
 
 async def check_and_download_stickers():
@@ -158,36 +403,258 @@ async def check_and_download_stickers():
 
     @with_semaphore(semaphore)
     async def download(path_str: str):
-        path = anyio.Path(RESOURCE_FOLDER) / path_str
-        if not (await (dir_name := path.parent).exists()):
-            await dir_name.mkdir(parents=True, exist_ok=True)
-
-        logger.opt(colors=True).info(f"Downloading sticker <y>{path.name}</y>")
-        urls = append_prefix(f"public/img/{path_str}", config.pjsk_assets_prefix)
-        await path.write_bytes(await async_request(*urls))
+        logger.opt(colors=True).info(f"Downloading sticker <y>{path_str}</y>")
+        await fetch_asset(RESOURCE_FOLDER / path_str, get_sticker_urls(path_str))
 
     logger.debug("Checking and downloading sticker assets")
-    tasks: List[Coroutine] = [
-        download(sticker_info.img)
-        for sticker_info in LOADED_STICKER_INFO
-        if not (RESOURCE_FOLDER / sticker_info.img).exists()
-    ]
+    paths = get_sticker_image_paths()
+    verified = await asyncio.gather(
+        *(verify_asset(RESOURCE_FOLDER / x) for x in paths),
+    )
+    tasks: List[Coroutine] = [download(x) for x, ok in zip(paths, verified) if not ok]
     await asyncio.gather(*tasks)
 
 
-async def check_and_download_resource():
-    await load_sticker_info()
-    await check_and_download_stickers()
+sticker_flight: SingleFlight[None] = SingleFlight()
+
+
+async def fetch_sticker(path: Path):
+    """downloads the sticker image, concurrent calls share one download"""
+
+    path_str = path.relative_to(RESOURCE_FOLDER).as_posix()
+
+    async def download():
+        logger.opt(colors=True).info(f"Downloading sticker <y>{path_str}</y>")
+        await fetch_asset(path, get_sticker_urls(path_str))
+
+    await sticker_flight.do(str(path), download)
+
+
+async def ensure_asset(path: Path):
+    """downloads a sticker image the first time it is needed if it is missing"""
+    if path.is_file() or (not path.is_relative_to(RESOURCE_FOLDER)):
+        return
+    await fetch_sticker(path)
+
+
+async def prefetch_stickers():
+    """downloads the sticker images not fetched on demand yet, a few at a time"""
+
+    await bootstrap_assets()
+
+    semaphore = asyncio.Semaphore(max(config.pjsk_prefetch_concurrency, 1))
+
+    @with_semaphore(semaphore)
+    async def prefetch(path: Path) -> bool:
+        try:
+            if await verify_asset(path):
+                return False
+            await fetch_sticker(path)
+        except Exception as e:
+            logger.warning(f"Failed to prefetch `{path.name}`: {e!r}")
+            return False
+        return True
+
+    logger.debug("Prefetching sticker images")
+    paths = get_sticker_image_paths()
+    results = await asyncio.gather(*(prefetch(RESOURCE_FOLDER / x) for x in paths))
+    await asset_manifest.save()
+    logger.info(f"Prefetched sticker images, {sum(results)} of them downloaded")
+
+
+async def revalidate_asset(path: Path, urls: List[str]) -> bool:
+    """
+    Re-fetches the asset if it changed upstream, assets without validators,
+    e.g. extracted from archives, are compared by size with a `HEAD` request
+    and take its validators instead of being downloaded again
+    """
+
+    if path in fetched_assets:
+        return False
+
+    record = asset_manifest.get(path)
+    if record and not asset_manifest.has_validators(path):
+        response = await async_request(
+            *urls,
+            response_type=ResponseType.RESPONSE,
+            method="HEAD",
+            headers={"Accept-Encoding": "identity"},
+        )
+        if response.headers.get("Content-Length") == str(record.size):
+            asset_manifest.update_validators(path, response)
+            return False
+
+    return await fetch_asset(path, urls, conditional=True)
+
+
+async def revalidate_assets():
+    """re-fetches the font and sticker images that changed upstream"""
+
+    semaphore = asyncio.Semaphore(10)
+
+    @with_semaphore(semaphore)
+    async def revalidate(path: Path, urls: List[str]) -> bool:
+        try:
+            return await revalidate_asset(path, urls)
+        except Exception as e:
+            logger.warning(f"Failed to revalidate `{path.name}`: {e!r}")
+            return False
+
+    logger.debug("Revalidating downloaded assets")
+    paths = get_sticker_image_paths()
+    results = await asyncio.gather(
+        revalidate(FONT_PATH, get_font_urls()),
+        *(revalidate(RESOURCE_FOLDER / x, get_sticker_urls(x)) for x in paths),
+    )
+    await asset_manifest.save()
+    logger.info(f"Revalidated assets, {sum(results)} of them updated")
+
+
+def get_archive_member_target(name: str) -> Optional[Path]:
+    parts = PurePosixPath(name).parts
+    if ".." in parts:
+        return None
+    if parts[-2:] == ("fonts", FONT_PATH.name):
+        return FONT_PATH
+    for i in range(len(parts) - 2):
+        if parts[i : i + 2] == ("public", "img"):
+            return RESOURCE_FOLDER.joinpath(*parts[i + 2 :])
+    return None
+
+
+def extract_asset_archive_sync(archive_path: Path) -> List[Path]:
+    """
+    Extracts sticker images under `public/img/` and the font from a zip or tar
+    archive, members are copied one by one so the archive is never fully loaded,
+    files that already verify are left alone
+    """
+
+    written: List[Path] = []
+
+    def write(target: Path, src: IO[bytes]):
+        if verify_asset_sync(target):
+            return
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = target.with_name(f"{target.name}.tmp")
+        digest = hashlib.sha256()
+        size = 0
+        with tmp_path.open("wb") as f:
+            while chunk := src.read(65536):
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        tmp_path.replace(target)
+        asset_manifest.records[asset_manifest.make_key(target)] = AssetRecord(
+            sha256=digest.hexdigest(),
+            size=size,
+        )
+        fetched_assets.add(target)
+        written.append(target)
+
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as zf:
+            for info in zf.infolist():
+                target = get_archive_member_target(info.filename)
+                if target and not info.is_dir():
+                    with zf.open(info) as src:
+                        write(target, src)
+        return written
+
+    with tarfile.open(archive_path, "r:*") as tf:
+        for member in tf:
+            target = get_archive_member_target(member.name)
+            if target and member.isfile() and (src := tf.extractfile(member)):
+                with src:
+                    write(target, src)
+    return written
+
+
+async def download_to_file(url: str, path: Path):
+    async with get_client().stream("GET", url) as response:
+        response.raise_for_status()
+        async with await anyio.open_file(path, "wb") as f:
+            async for chunk in response.aiter_bytes(65536):
+                await f.write(chunk)
+
+
+async def count_missing_stickers() -> int:
+    verified = await asyncio.gather(
+        *(verify_asset(RESOURCE_FOLDER / x) for x in get_sticker_image_paths()),
+    )
+    return len(verified) - sum(verified)
+
+
+async def bootstrap_assets():
+    """
+    Fills a fresh node from asset archives instead of one request per file,
+    assets still missing afterwards are downloaded one by one as usual
+    """
+
+    for i, url in enumerate(config.pjsk_bootstrap_archive_urls):
+        # earlier archives may have filled in enough already
+        missing = await count_missing_stickers()
+        if missing < config.pjsk_bootstrap_min_missing:
+            return
+        if not i:
+            logger.info(
+                f"{missing} sticker images missing, bootstrapping from archives",
+            )
+
+        archive_path = DATA_FOLDER / "bootstrap.tmp"
+        try:
+            logger.opt(colors=True).info(f"Downloading asset archive <y>{url}</y>")
+            await download_to_file(url, archive_path)
+            written = await anyio.to_thread.run_sync(
+                extract_asset_archive_sync,
+                archive_path,
+            )
+        except Exception as e:
+            logger.warning(f"Failed to bootstrap assets from `{url}`: {e!r}")
+            continue
+        finally:
+            archive_path.unlink(missing_ok=True)
+
+        for path in written:
+            for handler in ASSET_UPDATE_HANDLERS:
+                handler(path)
+        logger.info(f"Extracted {len(written)} assets from `{url}`")
+
+
+async def sync_assets_in_background():
+    if config.pjsk_lazy_assets:
+        await prefetch_stickers()
+    if config.pjsk_revalidate_assets:
+        await revalidate_assets()
+
+
+async def make_data_folders():
+    for folder in (DATA_FOLDER, FONT_FOLDER, RESOURCE_FOLDER):
+        await anyio.Path(folder).mkdir(parents=True, exist_ok=True)
 
 
 async def prepare_resource():
     logger.debug("Checking and downloading resources")
-    await asyncio.gather(
-        check_and_download_resource(),
-        check_and_download_font(),
-    )
+    await make_data_folders()
+    asset_manifest.load()
+    try:
+        await load_sticker_info()
+        if config.pjsk_lazy_assets:
+            # sticker images are fetched on demand and prefetched in background
+            await check_and_download_font()
+        else:
+            await bootstrap_assets()
+            await asyncio.gather(
+                check_and_download_stickers(),
+                check_and_download_font(),
+            )
+    finally:
+        await asset_manifest.save()
     logger.success("Successfully checked resources")
 
+    if config.pjsk_lazy_assets or config.pjsk_revalidate_assets:
+        create_background_task(sync_assets_in_background())
+
 
 driver = get_driver()
 driver.on_startup(prepare_resource)
+driver.on_shutdown(close_client)
@@ -0,0 +1,250 @@
+import asyncio
+import heapq
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from .config import config
+from .metrics import metrics
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    GRID = 1
+    BACKGROUND = 2
+
+
+class RenderBusyError(Exception):
+    pass
+
+
+class RenderRateLimitedError(Exception):
+    pass
+
+
+class Requester:
+    def __init__(self, user_id: str, group_id: Optional[str] = None) -> None:
+        self.user_id = user_id
+        self.group_id = group_id
+
+
+requester_var: ContextVar[Optional[Requester]] = ContextVar(
+    "pjsk_render_requester",
+    default=None,
+)
+priority_var: ContextVar[Optional[Priority]] = ContextVar(
+    "pjsk_render_priority",
+    default=None,
+)
+
+
+@contextmanager
+def render_priority(priority: Priority) -> Iterator[None]:
+    """overrides the priority of renders started in this context"""
+    token = priority_var.set(priority)
+    try:
+        yield
+    finally:
+        priority_var.reset(token)
+
+
+# `[priority, sequence, future]`, a list so `promote` can change the priority
+QueueEntry = List[Any]
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refilled(self, now: float) -> float:
+        return min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+
+    def consume(self, amount: float = 1) -> bool:
+        now = time.monotonic()
+        self.tokens = self.refilled(now)
+        self.updated = now
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+
+class RenderScheduler:
+    """
+    Caps concurrent renders, queues the rest by priority with a bounded
+    queue, and limits how often each user and group can start renders
+    """
+
+    def __init__(
+        self,
+        concurrency: int,
+        max_queue: int,
+        user_rate: float = 0,
+        user_burst: float = 1,
+        group_rate: float = 0,
+        group_burst: float = 1,
+    ) -> None:
+        self.concurrency = max(concurrency, 1)
+        self.max_queue = max_queue
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.running = 0
+        self.foreground = 0
+        self.last_foreground = time.monotonic()
+        self._seq = 0
+        self._queue: List[QueueEntry] = []
+        self._queued_keys: Dict[str, QueueEntry] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def foreground_queue_depth(self) -> int:
+        return sum(x[0] < Priority.BACKGROUND for x in self._queue)
+
+    def _consume(self, key: str, rate: float, burst: float) -> bool:
+        if rate <= 0:
+            return True
+        if not (bucket := self._buckets.get(key)):
+            bucket = self._buckets[key] = TokenBucket(rate, max(burst, 1))
+        return bucket.consume()
+
+    def prune_buckets(self) -> int:
+        """drops the buckets that refilled, they are created again when needed"""
+        now = time.monotonic()
+        full = [k for k, v in self._buckets.items() if v.refilled(now) >= v.capacity]
+        for key in full:
+            del self._buckets[key]
+        return len(full)
+
+    def check_rate_limit(self):
+        """consumes a token of the current requester, raises when out of tokens"""
+
+        if not (requester := requester_var.get()):
+            return
+        if not self._consume(
+            f"user:{requester.user_id}",
+            self.user_rate,
+            self.user_burst,
+        ):
+            metrics.inc("render_rejected_total", reason="rate_limited")
+            raise RenderRateLimitedError
+        if requester.group_id and not self._consume(
+            f"group:{requester.group_id}",
+            self.group_rate,
+            self.group_burst,
+        ):
+            metrics.inc("render_rejected_total", reason="rate_limited")
+            raise RenderRateLimitedError
+
+    def _release(self):
+        while self._queue:
+            *_, future = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(None)  # hand the slot over
+                return
+        self.running -= 1
+
+    def promote(self, key: str, priority: Priority):
+        """
+        raises the priority of the render queued under `key`,
+        e.g. when an interactive request joins a background render
+        """
+        entry = self._queued_keys.get(key)
+        if entry and priority < entry[0]:
+            entry[0] = int(priority)
+            heapq.heapify(self._queue)
+
+    def stats(self) -> Dict[str, int]:
+        return {"running": self.running, "queue_depth": self.queue_depth}
+
+    def idle_seconds(self) -> float:
+        """seconds since the last render that is not in background finished"""
+        if self.foreground:
+            return 0
+        return time.monotonic() - self.last_foreground
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        priority: Priority,
+        key: Optional[str] = None,
+    ) -> AsyncIterator[None]:
+        """`key` identifies the render while queued, for `promote`"""
+        foreground = priority < Priority.BACKGROUND
+        if foreground:
+            self.foreground += 1
+        try:
+            async with self._acquire(priority, key):
+                yield
+        finally:
+            if foreground:
+                self.foreground -= 1
+                self.last_foreground = time.monotonic()
+
+    @asynccontextmanager
+    async def _acquire(
+        self,
+        priority: Priority,
+        key: Optional[str] = None,
+    ) -> AsyncIterator[None]:
+        if (not self._queue) and self.running < self.concurrency:
+            self.running += 1
+        else:
+            metrics.inc("render_queued_total", priority=priority.name.lower())
+            # background renders are bounded by their own callers,
+            # and run after every queued foreground render anyway
+            if (
+                priority < Priority.BACKGROUND
+                and self.foreground_queue_depth >= self.max_queue
+            ):
+                metrics.inc("render_rejected_total", reason="busy")
+                raise RenderBusyError
+
+            future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+            entry: QueueEntry = [int(priority), self._seq, future]
+            self._seq += 1
+            heapq.heappush(self._queue, entry)
+            if key is not None:
+                self._queued_keys[key] = entry
+            try:
+                with metrics.time(
+                    "render_queue_seconds",
+                    priority=priority.name.lower(),
+                ):
+                    await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self._release()  # slot was handed over right before cancelling
+                else:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                raise
+            finally:
+                if key is not None and self._queued_keys.get(key) is entry:
+                    del self._queued_keys[key]
+
+        try:
+            yield
+        finally:
+            self._release()
+
+
+render_scheduler = RenderScheduler(
+    config.pjsk_render_concurrency,
+    config.pjsk_render_queue_size,
+    user_rate=config.pjsk_user_rate_limit,
+    user_burst=config.pjsk_user_rate_burst,
+    group_rate=config.pjsk_group_rate_limit,
+    group_burst=config.pjsk_group_rate_burst,
+)
+metrics.register_collector("render_scheduler", render_scheduler.stats)
@@ -1,27 +1,39 @@
+import asyncio
+import random
 import unicodedata
 from asyncio import Semaphore
 from enum import Enum, auto
 from functools import lru_cache
+from importlib.util import find_spec
 from typing import (
+    TYPE_CHECKING,
     Any,
     Awaitable,
     Callable,
+    Coroutine,
+    Dict,
+    Generic,
     Iterable,
     List,
     Literal,
     Optional,
     Sequence,
+    Set,
     Type,
     TypeVar,
     Union,
     overload,
 )
 from typing_extensions import ParamSpec
+from urllib.parse import urlsplit
 
-from httpx import AsyncClient
-from nonebot import logger
+from nonebot import get_driver, logger
 
 from .config import config
+from .metrics import metrics
+
+if TYPE_CHECKING:
+    from httpx import AsyncClient, Response
 
 T = TypeVar("T")
 TN = TypeVar("TN", int, float)
@@ -35,6 +47,7 @@ class ResponseType(Enum):
     JSON = auto()
     TEXT = auto()
     BYTES = auto()
+    RESPONSE = auto()  # raw response, `304 Not Modified` is not treated as error
 
 
 @overload
@@ -42,6 +55,8 @@ async def async_request(
     *urls: str,
     response_type: Literal[ResponseType.JSON],
     retries: int = config.pjsk_req_retry,
+    headers: Optional[Dict[str, str]] = None,
+    method: str = "GET",
 ) -> Any:
     ...
 
@@ -51,15 +66,30 @@ async def async_request(
     *urls: str,
     response_type: Literal[ResponseType.TEXT],
     retries: int = config.pjsk_req_retry,
+    headers: Optional[Dict[str, str]] = None,
+    method: str = "GET",
 ) -> str:
     ...
 
 
+@overload
+async def async_request(
+    *urls: str,
+    response_type: Literal[ResponseType.RESPONSE],
+    retries: int = config.pjsk_req_retry,
+    headers: Optional[Dict[str, str]] = None,
+    method: str = "GET",
+) -> "Response":
+    ...
+
+
 @overload
 async def async_request(
     *urls: str,
     response_type: ResponseType = ResponseType.BYTES,
     retries: int = config.pjsk_req_retry,
+    headers: Optional[Dict[str, str]] = None,
+    method: str = "GET",
 ) -> bytes:
     ...
 
@@ -68,37 +98,150 @@ async def async_request(
     *urls: str,
     response_type: ResponseType = ResponseType.BYTES,
     retries: int = config.pjsk_req_retry,
+    headers: Optional[Dict[str, str]] = None,
+    method: str = "GET",
 ) -> Any:
     if not urls:
         raise ValueError("No URL specified")
 
-    url, rest = urls[0], urls[1:]
+    if config.pjsk_req_race and len(urls) >= 2:
+        raced, urls = urls[:2], urls[2:]
+        try:
+            return await race_first_success(
+                *(
+                    request_with_retry(x, response_type, retries, headers, method)
+                    for x in raced
+                ),
+            )
+        except Exception as e:
+            if not urls:
+                raise
+            logger.error(f"Requesting next url because racing {raced} failed: {e!r}")
+
+    *rest, last = urls
+    for url in rest:
+        try:
+            return await request_with_retry(
+                url,
+                response_type,
+                retries,
+                headers,
+                method,
+            )
+        except Exception as e:
+            logger.error(
+                f"Requesting next url because error occurred while requesting {url}: "
+                f"{e.__class__.__name__}: {e}",
+            )
+            logger.debug(repr(e))
+    return await request_with_retry(last, response_type, retries, headers, method)
+
+
+async def request_once(
+    url: str,
+    response_type: ResponseType,
+    headers: Optional[Dict[str, str]] = None,
+    method: str = "GET",
+) -> Any:
+    with metrics.time("request_seconds", host=urlsplit(url).hostname or ""):
+        response = await get_client().request(method, url, headers=headers)
+    metrics.inc("requests_total", status=str(response.status_code))
+    if response_type == ResponseType.RESPONSE and response.status_code == 304:
+        return response
+    response.raise_for_status()
+    if response_type == ResponseType.RESPONSE:
+        return response
+    if response_type == ResponseType.JSON:
+        return response.json()
+    if response_type == ResponseType.TEXT:
+        return response.text
+    return response.content
+
+
+async def request_with_retry(
+    url: str,
+    response_type: ResponseType,
+    retries: int = config.pjsk_req_retry,
+    headers: Optional[Dict[str, str]] = None,
+    method: str = "GET",
+) -> Any:
+    attempt = 0
+    while True:
+        try:
+            return await request_once(url, response_type, headers, method)
+        except Exception as e:
+            if attempt >= retries:
+                raise
+            delay = get_backoff_delay(attempt)
+            attempt += 1
+            logger.error(
+                f"Retrying ({retries - attempt} left) in {delay:.2f}s "
+                f"because error occurred while requesting {url}: "
+                f"{e.__class__.__name__}: {e}",
+            )
+            logger.debug(repr(e))
+            await asyncio.sleep(delay)
+
+
+def get_backoff_delay(attempt: int) -> float:
+    """exponential backoff with full jitter"""
+    cap = min(config.pjsk_req_backoff_max, config.pjsk_req_backoff_base * 2**attempt)
+    return random.uniform(0, cap)
+
+
+async def race_first_success(*coros: Awaitable[T]) -> T:
+    """returns result of the first coroutine succeeded, cancels the others"""
+
+    tasks = [asyncio.ensure_future(x) for x in coros]
+    error: Optional[BaseException] = None
     try:
-        async with AsyncClient(
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in done:
+                if (e := task.exception()) is None:
+                    return task.result()
+                error = e
+        assert error
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+_client: Optional["AsyncClient"] = None
+
+
+def get_client() -> "AsyncClient":
+    global _client
+    if (not _client) or _client.is_closed:
+        from httpx import AsyncClient, Limits
+
+        http2 = config.pjsk_req_http2
+        if http2 and (not find_spec("h2")):
+            logger.warning("Package `h2` not installed, HTTP/2 disabled")
+            http2 = False
+        _client = AsyncClient(
             proxy=config.pjsk_req_proxy,
             timeout=config.pjsk_req_timeout,
-        ) as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            if response_type == ResponseType.JSON:
-                return await response.json()
-            if response_type == ResponseType.TEXT:
-                return response.text
-            return response.read()
+            http2=http2,
+            limits=Limits(
+                max_connections=config.pjsk_req_max_connections,
+                max_keepalive_connections=config.pjsk_req_max_connections,
+            ),
+            follow_redirects=True,
+        )
+    return _client
 
-    except Exception as e:
-        err_suffix = f"because error occurred while requesting {url}: {e.__class__.__name__}: {e}"
-        if retries <= 0:
-            if not rest:
-                raise
-            logger.error(f"Requesting next url {err_suffix}")
-            logger.debug(repr(e))
-            return await async_request(*rest, response_type=response_type)
 
-        retries -= 1
-        logger.error(f"Retrying ({retries} left) {err_suffix}")
-        logger.debug(repr(e))
-        return await async_request(*urls, response_type=response_type, retries=retries)
+async def close_client():
+    global _client
+    if _client:
+        await _client.aclose()
+        _client = None
 
 
 def append_prefix(suffix: str, prefixes: Sequence[str]) -> List[str]:
@@ -116,6 +259,60 @@ def with_semaphore(semaphore: Semaphore):
     return decorator
 
 
+class SingleFlight(Generic[T]):
+    """Concurrent calls with the same key share one execution and its result"""
+
+    def __init__(self) -> None:
+        self._calls: Dict[str, "asyncio.Future[T]"] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._calls
+
+    async def do(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        while (future := self._calls.get(key)) is not None:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # the caller running it was cancelled, take over the call
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark as retrieved when nobody is waiting
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._calls.pop(key, None)
+
+
+background_tasks: Set["asyncio.Task[Any]"] = set()
+
+
+def create_background_task(coro: Coroutine[Any, Any, T]) -> "asyncio.Task[T]":
+    """keeps the task until it is done, it is cancelled on shutdown"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+async def cancel_background_tasks():
+    tasks = list(background_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
 def chunks(iterable: Sequence[T], size: int) -> Iterable[Sequence[T]]:
     for i in range(0, len(iterable), size):
         yield iterable[i : i + size]
@@ -150,3 +347,9 @@ def qor(a: Optional[TA], b: Union[TB, Callable[[], TB]]) -> Union[TA, TB]:
 @lru_cache()
 def is_full_width(char: str) -> bool:
     return unicodedata.east_asian_width(char) in ("A", "F", "W")
+
+
+driver = get_driver()
+# registered before the modules closing the client and caches, so nothing
+# running in background uses them after they are closed
+driver.on_shutdown(cancel_background_tasks)
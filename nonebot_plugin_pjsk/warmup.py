@@ -0,0 +1,220 @@
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Set
+
+import anyio
+from nonebot import get_driver, logger
+from nonebot.compat import model_dump, type_validate_json
+from pydantic import BaseModel
+
+from .cache import get_cache_backend, wait_cache_cleaned
+from .config import config
+from .encode import get_image_encoding
+from .render import (
+    StickerRenderKwargs,
+    get_cache_filename,
+    get_sticker,
+    get_sticker_cache_key_maker,
+    make_sticker_render_kwargs,
+)
+from .resource import DATA_FOLDER, get_catalog, make_cache_key
+from .scheduler import Priority, render_priority, render_scheduler
+from .utils import create_background_task
+
+POPULARITY_PATH = DATA_FOLDER / "popularity.json"
+POPULARITY_MAX_ENTRIES = 1000
+
+
+class PopularityRecord(BaseModel):
+    sticker_id: str
+    params: Dict[str, Any]
+    score: float
+    updated: float
+
+
+class StickerPopularity:
+    """
+    Request counts of sticker render parameters, halved every `half_life`
+    seconds so recent requests weigh more
+    """
+
+    def __init__(self, path: Path, half_life: float, max_entries: int) -> None:
+        self.path = path
+        self.half_life = half_life
+        self.max_entries = max_entries
+        self.records: Dict[str, PopularityRecord] = {}
+
+    def score(self, record: PopularityRecord, now: float) -> float:
+        if self.half_life <= 0:
+            return record.score
+        return record.score * 0.5 ** ((now - record.updated) / self.half_life)
+
+    def record(self, sticker_id: str, params: StickerRenderKwargs):
+        now = time.time()
+        key = make_cache_key(params)
+        if record := self.records.get(key):
+            record.score = self.score(record, now) + 1
+            record.updated = now
+            return
+
+        self.records[key] = PopularityRecord(
+            sticker_id=sticker_id,
+            params=dict(params),
+            score=1,
+            updated=now,
+        )
+        if len(self.records) > self.max_entries:
+            # drop the least popular tenth at once instead of one by one
+            keep = sorted(
+                self.records.items(),
+                key=lambda x: self.score(x[1], now),
+                reverse=True,
+            )[: self.max_entries * 9 // 10]
+            self.records = dict(keep)
+
+    def top(self, n: int) -> List[PopularityRecord]:
+        now = time.time()
+        return sorted(
+            self.records.values(),
+            key=lambda x: self.score(x, now),
+            reverse=True,
+        )[:n]
+
+    def load(self):
+        if not self.path.exists():
+            return
+        try:
+            self.records = type_validate_json(
+                Dict[str, PopularityRecord],
+                self.path.read_text(encoding="u8"),
+            )
+        except Exception as e:
+            logger.warning(f"Failed to load sticker popularity, ignoring it: {e!r}")
+            self.records = {}
+
+    async def save(self):
+        data = json.dumps(
+            {k: model_dump(v) for k, v in self.records.items()},
+            ensure_ascii=False,
+        )
+        tmp_path = anyio.Path(self.path.with_name(f"{self.path.name}.tmp"))
+        await tmp_path.write_text(data, encoding="u8")
+        await tmp_path.replace(self.path)
+
+
+sticker_popularity = StickerPopularity(
+    POPULARITY_PATH,
+    config.pjsk_popularity_half_life,
+    POPULARITY_MAX_ENTRIES,
+)
+
+
+def get_warmup_targets() -> List[StickerRenderKwargs]:
+    """most requested stickers first, then every sticker with its default text"""
+
+    catalog = get_catalog()
+    targets: List[StickerRenderKwargs] = [
+        x.params  # type: ignore
+        for x in sticker_popularity.top(config.pjsk_warmup_top_n)
+        if catalog.get(x.sticker_id)
+    ]
+    if config.pjsk_warmup_default_stickers:
+        targets.extend(
+            make_sticker_render_kwargs(x, auto_adjust=True) for x in catalog.stickers
+        )
+
+    seen: Set[str] = set()
+    unique: List[StickerRenderKwargs] = []
+    for params in targets:
+        if (key := make_cache_key(params)) not in seen:
+            seen.add(key)
+            unique.append(params)
+    return unique
+
+
+def is_idle() -> bool:
+    return render_scheduler.idle_seconds() >= config.pjsk_warmup_idle_time
+
+
+async def warm_sticker(params: StickerRenderKwargs) -> bool:
+    """renders the sticker into the cache, `False` if it was there already"""
+
+    filename = get_cache_filename(
+        get_sticker_cache_key_maker(**params),
+        get_image_encoding("sticker"),
+    )
+    # not `get_cache`, which would pull the image into the memory cache
+    if await get_cache_backend().get(filename) is not None:
+        return False
+    await get_sticker(**params)
+    return True
+
+
+async def warm_stickers() -> int:
+    """
+    Pre-renders popular and default stickers missing from the cache,
+    stops as soon as other renders come in
+    """
+
+    targets = iter(get_warmup_targets())
+    # share of time each task spends rendering, the rest is spent sleeping
+    budget = min(max(config.pjsk_warmup_cpu_budget, 0.01), 1)
+    rendered = 0
+
+    async def warm():
+        nonlocal rendered
+        for params in targets:
+            if not is_idle():
+                return
+            start = time.perf_counter()
+            try:
+                rendered += await warm_sticker(params)
+            except Exception as e:
+                logger.warning(f"Failed to pre-render sticker: {e!r}")
+            await asyncio.sleep((time.perf_counter() - start) * (1 / budget - 1))
+
+    with render_priority(Priority.BACKGROUND):
+        await asyncio.gather(
+            *(warm() for _ in range(max(config.pjsk_warmup_concurrency, 1))),
+        )
+    return rendered
+
+
+async def wait_idle():
+    while (idle := render_scheduler.idle_seconds()) < config.pjsk_warmup_idle_time:
+        await asyncio.sleep(config.pjsk_warmup_idle_time - idle)
+
+
+async def warmup_loop():
+    await wait_cache_cleaned()
+    while True:
+        await wait_idle()
+        try:
+            if rendered := await warm_stickers():
+                logger.debug(f"Pre-rendered {rendered} stickers")
+            await sticker_popularity.save()
+        except Exception:
+            logger.exception("Error occurred while pre-rendering stickers")
+        await asyncio.sleep(config.pjsk_warmup_interval)
+
+
+async def start_warmup():
+    sticker_popularity.load()
+    if not (config.pjsk_warmup_stickers and config.pjsk_use_cache):
+        return
+    create_background_task(warmup_loop())
+
+
+async def stop_warmup():
+    # the warmup loop is cancelled and awaited before this
+    try:
+        await sticker_popularity.save()
+    except Exception:
+        logger.exception("Error occurred while saving sticker popularity")
+
+
+driver = get_driver()
+driver.on_startup(start_warmup)
+driver.on_shutdown(stop_warmup)
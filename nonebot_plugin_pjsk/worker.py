@@ -0,0 +1,329 @@
+import asyncio
+import itertools
+import pickle
+import subprocess
+import sys
+from contextlib import suppress
+from typing import (
+    IO,
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+import anyio
+from nonebot import get_driver, logger
+from nonebot.compat import model_dump
+
+from .config import config
+from .metrics import metrics
+
+WORKER_RESTART_DELAY = 1
+WORKER_RESTART_DELAY_MAX = 30
+WORKER_STOP_TIMEOUT = 10
+
+# the plugin can not be imported before nonebot is initialized,
+# so workers are started from this script instead of multiprocessing
+WORKER_SCRIPT = """
+import os, pickle, sys
+
+# keep stdout for results, anything printed goes to stderr instead
+output = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+size = int.from_bytes(sys.stdin.buffer.read(4), "big")
+sys.path, plugin, env = pickle.loads(sys.stdin.buffer.read(size))
+
+import importlib
+import nonebot
+
+nonebot.init(**env)
+nonebot.load_plugin(plugin)
+
+importlib.import_module(f"{plugin}.worker").serve_worker(sys.stdin.buffer, output)
+"""
+
+Job = Callable[..., Awaitable[bytes]]
+TJ = TypeVar("TJ", bound=Job)
+
+WORKER_JOBS: Dict[str, Job] = {}
+
+
+class RenderWorkerError(Exception):
+    """Render failed inside a worker, or the worker exited while rendering"""
+
+
+def register_worker_job(name: str) -> Callable[[TJ], TJ]:
+    def decorator(func: TJ) -> TJ:
+        WORKER_JOBS[name] = func
+        return func
+
+    return decorator
+
+
+def write_frame(f: IO[bytes], obj: Any):
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    f.write(len(data).to_bytes(4, "big"))
+    f.write(data)
+    f.flush()
+
+
+def read_frame(f: IO[bytes]) -> Optional[Any]:
+    """`None` when the other side closed the pipe"""
+
+    header = f.read(4)
+    if len(header) < 4:
+        return None
+    size = int.from_bytes(header, "big")
+    data = f.read(size)
+    if len(data) < size:
+        return None
+    return pickle.loads(data)  # noqa: S301
+
+
+def get_worker_init() -> Tuple[List[str], str, Dict[str, Any]]:
+    """`sys.path`, plugin module and nonebot config the worker starts with"""
+
+    env = model_dump(get_driver().config)
+    env.update(
+        driver="~none",
+        pjsk_render_workers=0,
+        pjsk_metrics_exporters=[],
+        pjsk_prerender_grids=False,
+    )
+    return sys.path, __name__.rpartition(".")[0], env
+
+
+class RenderWorker:
+    """A render process with its own browser, restarted when it exits"""
+
+    def __init__(self, index: int) -> None:
+        self.index = index
+        self.restarts = 0
+        self.in_flight: Dict[int, "asyncio.Future[bytes]"] = {}
+        self._proc: Optional[subprocess.Popen] = None
+        self._reader: Optional["asyncio.Task[None]"] = None
+        self._job_ids = itertools.count()
+        self._running = False
+
+    @property
+    def alive(self) -> bool:
+        return bool(self._proc) and self._proc.poll() is None  # type: ignore
+
+    def _spawn(self):
+        proc = subprocess.Popen(  # noqa: S603
+            [sys.executable, "-c", WORKER_SCRIPT],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        assert proc.stdin
+        write_frame(proc.stdin, get_worker_init())
+        self._proc = proc
+        logger.debug(f"Started render worker #{self.index}, pid {proc.pid}")
+
+    async def _read_loop(self):
+        delay = WORKER_RESTART_DELAY
+        while True:
+            proc = self._proc
+            assert proc and proc.stdout
+            # each reader gets its own thread so it does not take up the default ones
+            limiter = anyio.CapacityLimiter(1)
+            while (
+                frame := await anyio.to_thread.run_sync(
+                    read_frame,
+                    proc.stdout,
+                    limiter=limiter,
+                )
+            ) is not None:
+                job_id, ok, result = frame
+                delay = WORKER_RESTART_DELAY
+                if (future := self.in_flight.pop(job_id, None)) and not future.done():
+                    if ok:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(RenderWorkerError(result))
+
+            code = await anyio.to_thread.run_sync(proc.wait)
+            self._fail_in_flight(f"Render worker exited with code {code}")
+            if not self._running:
+                return
+
+            logger.warning(
+                f"Render worker #{self.index} exited with code {code}, "
+                f"restarting in {delay}s",
+            )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WORKER_RESTART_DELAY_MAX)
+            if not self._running:
+                return
+            try:
+                self._spawn()
+            except Exception:
+                logger.exception(f"Failed to restart render worker #{self.index}")
+                return
+            self.restarts += 1
+
+    def _fail_in_flight(self, message: str):
+        for future in self.in_flight.values():
+            if not future.done():
+                future.set_exception(RenderWorkerError(message))
+        self.in_flight.clear()
+
+    def start(self):
+        self._running = True
+        self._spawn()
+        self._reader = asyncio.create_task(self._read_loop())
+
+    async def stop(self):
+        self._running = False
+        if proc := self._proc:
+            if proc.stdin:
+                # workers finish what they have and exit when stdin closes
+                with suppress(OSError):
+                    proc.stdin.close()
+            try:
+                await anyio.to_thread.run_sync(proc.wait, WORKER_STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                logger.warning(f"Render worker #{self.index} did not exit, killing")
+                proc.kill()
+        if self._reader:
+            # may be waiting to restart the worker
+            self._reader.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._reader
+            self._reader = None
+
+    async def run(self, name: str, *args: Any) -> bytes:
+        proc = self._proc
+        if not (proc and proc.stdin and self.alive):
+            raise RenderWorkerError("Render worker is not running")
+
+        job_id = next(self._job_ids)
+        future: "asyncio.Future[bytes]" = asyncio.get_running_loop().create_future()
+        self.in_flight[job_id] = future
+        try:
+            write_frame(proc.stdin, (job_id, name, args))
+        except (BrokenPipeError, OSError) as e:
+            self.in_flight.pop(job_id, None)
+            raise RenderWorkerError("Render worker is not running") from e
+
+        try:
+            return await future
+        finally:
+            self.in_flight.pop(job_id, None)
+
+
+class RenderWorkerPool:
+    """Sends render jobs to the least busy worker process"""
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.workers: List[RenderWorker] = []
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def available(self) -> bool:
+        return any(x.alive for x in self.workers)
+
+    def pick(self) -> RenderWorker:
+        alive = [x for x in self.workers if x.alive]
+        if not alive:
+            raise RenderWorkerError("No render worker is running")
+        return min(alive, key=lambda x: len(x.in_flight))
+
+    async def run(self, name: str, *args: Any) -> bytes:
+        """
+        runs the job in a worker, once more in another if the worker exits,
+        or in this process when no worker is running
+        """
+
+        if not self.available():
+            return await run_job(name, args)
+        worker = self.pick()
+        try:
+            return await worker.run(name, *args)
+        except RenderWorkerError:
+            if worker.alive:
+                raise  # the job itself failed
+            if not self.available():
+                logger.warning(
+                    f"No render worker is running, rendering `{name}` in process",
+                )
+                return await run_job(name, args)
+            return await self.pick().run(name, *args)
+
+    async def start(self):
+        if not self.enabled:
+            return
+        self.workers = [RenderWorker(i) for i in range(self.size)]
+        for worker in self.workers:
+            worker.start()
+        logger.info(f"Started {self.size} render workers")
+
+    async def stop(self):
+        await asyncio.gather(*(x.stop() for x in self.workers))
+        self.workers.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "alive": sum(x.alive for x in self.workers),
+            "in_flight": sum(len(x.in_flight) for x in self.workers),
+            "restarts": sum(x.restarts for x in self.workers),
+        }
+
+
+async def run_job(name: str, args: Tuple[Any, ...]) -> bytes:
+    if not (job := WORKER_JOBS.get(name)):
+        raise ValueError(f"Unknown render job `{name}`")
+    return await job(*args)
+
+
+async def worker_main(reader: IO[bytes], writer: IO[bytes]):
+    tasks: Set["asyncio.Task[None]"] = set()
+
+    async def handle(job_id: int, name: str, args: Tuple[Any, ...]):
+        try:
+            result: Tuple[bool, Any] = (True, await run_job(name, args))
+        except Exception as e:
+            logger.exception(f"Error occurred while running render job `{name}`")
+            result = (False, f"{e.__class__.__name__}: {e}")
+        write_frame(writer, (job_id, *result))
+
+    limiter = anyio.CapacityLimiter(1)
+    while (
+        frame := await anyio.to_thread.run_sync(read_frame, reader, limiter=limiter)
+    ) is not None:
+        task = asyncio.create_task(handle(*frame))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.gather(*tasks)
+
+    from nonebot_plugin_htmlrender.browser import shutdown_browser
+
+    from .page import page_pool
+
+    await page_pool.close()
+    await shutdown_browser()
+
+
+def serve_worker(reader: IO[bytes], writer: IO[bytes]):
+    """entry of worker processes, renders jobs until stdin is closed"""
+    asyncio.run(worker_main(reader, writer))
+
+
+render_workers = RenderWorkerPool(config.pjsk_render_workers)
+metrics.register_collector("render_workers", render_workers.stats)
+
+driver = get_driver()
+driver.on_startup(render_workers.start)
+driver.on_shutdown(render_workers.stop)
@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator
+
+import nonebot
+import pytest
+from PIL import Image, ImageDraw
+from standin import StandInServer
+
+if TYPE_CHECKING:
+    from nonebot_plugin_pjsk.render import StickerRenderKwargs
+
+# the plugin keeps its data under the working directory
+os.chdir(tempfile.mkdtemp(prefix="pjsk-test-"))
+
+nonebot.init(driver="~none")
+nonebot.load_plugin("nonebot_plugin_pjsk")
+
+FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/System/Library/Fonts/Supplemental/Arial.ttf",
+    "C:/Windows/Fonts/arial.ttf",
+]
+
+
+@pytest.fixture()
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+def system_font() -> Path:
+    """a font file of the system to stand in for the sticker font"""
+
+    for path in FONT_CANDIDATES:
+        if Path(path).is_file():
+            return Path(path)
+    pytest.skip("No usable font found on this system")
+
+
+@pytest.fixture(scope="session")
+def browser_installed() -> None:
+    """skips instead of letting htmlrender try to install a browser"""
+
+    from playwright.sync_api import sync_playwright
+
+    with sync_playwright() as p:
+        if not Path(p.chromium.executable_path).is_file():
+            pytest.skip("Chromium of playwright is not installed")
+
+
+@pytest.fixture()
+def server() -> Iterator[StandInServer]:
+    yield from StandInServer.run()
+
+
+@pytest.fixture(scope="session")
+def sticker_image() -> Path:
+    from nonebot_plugin_pjsk.resource import RESOURCE_FOLDER
+
+    path = RESOURCE_FOLDER / "test" / "test_01.png"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    im = Image.new("RGBA", (296, 256), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(im)
+    draw.ellipse((40, 30, 256, 250), fill="#ff6699")
+    draw.rectangle((110, 90, 186, 160), fill="#ffffff")
+    im.save(path)
+    return path
+
+
+@pytest.fixture(scope="session")
+def sticker_font(system_font: Path) -> Path:
+    from nonebot_plugin_pjsk.resource import FONT_PATH
+
+    FONT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(system_font, FONT_PATH)
+    return FONT_PATH
+
+
+@pytest.fixture()
+def make_params(
+    sticker_image: Path,
+    sticker_font: Path,
+) -> Callable[..., "StickerRenderKwargs"]:
+    """render params of the test sticker, keyword arguments override them"""
+
+    from nonebot_plugin_pjsk.page import to_router_url
+
+    def factory(**kwargs: Any) -> "StickerRenderKwargs":
+        params: Dict[str, Any] = {
+            "image": to_router_url(sticker_image),
+            "x": 148,
+            "y": 58,
+            "text": "Hello World",
+            "font_color": "#ff0088",
+            "font_size": 36,
+            "rotate": 0,
+            "stroke_color": "#ffffff",
+            "stroke_width": 9,
+            "line_spacing": 1.3,
+            "font": to_router_url(sticker_font),
+            "width": 296,
+            "height": 256,
+        }
+        params.update(kwargs)
+        return params  # type: ignore
+
+    return factory
@@ -0,0 +1,192 @@
+"""Local stand-ins of the servers the plugin talks to"""
+
+import asyncio
+import fnmatch
+import hashlib
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+SLOW_DELAY = 2
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Serves `files` with ETags and answers conditional requests, other paths
+    are echoed back as body, except that paths starting with `/fail-<n>/`
+    answer 500 to their first n requests and `/slow/` waits before answering
+    """
+
+    daemon_threads = True
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.files: Dict[str, bytes] = {}
+        self.hits: Counter = Counter()
+        self.methods: Counter = Counter()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    @classmethod
+    def run(cls) -> Iterator["StandInServer"]:
+        server = cls()
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+        server.server_close()
+
+
+def make_etag(data: bytes) -> str:
+    return f'"{hashlib.sha1(data).hexdigest()}"'  # noqa: S324
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    server: StandInServer
+
+    def respond(self) -> Optional[Tuple[int, bytes, Dict[str, str]]]:
+        head, *_ = self.path.strip("/").split("/")
+        if head.startswith("fail-") and self.server.hits[self.path] <= int(head[5:]):
+            return 500, b"", {}
+        if head == "slow":
+            time.sleep(SLOW_DELAY)
+
+        data = self.server.files.get(self.path)
+        if data is None:
+            return 200, self.path.encode(), {}
+        etag = make_etag(data)
+        if self.headers.get("If-None-Match") == etag:
+            return 304, b"", {"ETag": etag}
+        return 200, data, {"ETag": etag}
+
+    def handle_request(self, send_body: bool):
+        self.server.hits[self.path] += 1
+        self.server.methods[self.command] += 1
+        status, body, headers = self.respond()  # type: ignore
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        if status != 304:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body and status != 304:
+            self.wfile.write(body)
+
+    def do_GET(self):  # noqa: N802
+        self.handle_request(send_body=True)
+
+    def do_HEAD(self):  # noqa: N802
+        self.handle_request(send_body=False)
+
+    def log_message(self, *_):
+        pass
+
+
+class StandInRedis:
+    """
+    Speaks enough of the Redis protocol, RESP2 and RESP3, for `RedisCache`:
+    `GET`, `SET` with `PX`/`EX`, `DEL`, `SCAN` with `MATCH` and `PING`
+    """
+
+    def __init__(self) -> None:
+        self.store: Dict[bytes, Tuple[bytes, float]] = {}
+        self.commands: Counter = Counter()
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def url(self) -> str:
+        assert self.server
+        return f"redis://127.0.0.1:{self.server.sockets[0].getsockname()[1]}/0"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def lookup(self, key: bytes) -> Optional[bytes]:
+        if not (item := self.store.get(key)):
+            return None
+        value, expire_at = item
+        if expire_at and expire_at < time.time():
+            del self.store[key]
+            return None
+        return value
+
+    def execute(self, args: List[bytes]) -> Any:
+        command = args[0].upper().decode()
+        self.commands[command] += 1
+        options = [x.upper() for x in args]
+
+        if command == "PING":
+            return "PONG"
+        if command == "GET":
+            return self.lookup(args[1])
+        if command == "SET":
+            expire_at = 0.0
+            if b"PX" in options:
+                expire_at = time.time() + int(args[options.index(b"PX") + 1]) / 1000
+            if b"EX" in options:
+                expire_at = time.time() + int(args[options.index(b"EX") + 1])
+            self.store[args[1]] = (args[2], expire_at)
+            return "OK"
+        if command == "DEL":
+            return sum(self.store.pop(x, None) is not None for x in args[1:])
+        if command == "SCAN":
+            match = args[options.index(b"MATCH") + 1] if b"MATCH" in options else b"*"
+            # fnmatch has no backslash escapes, use a one character class
+            pattern = re.sub(r"\\(.)", r"[\1]", match.decode())
+            keys = [
+                x
+                for x in list(self.store)
+                if self.lookup(x) is not None
+                and fnmatch.fnmatchcase(x.decode(), pattern)
+            ]
+            return [b"0", keys]
+        if command == "HELLO":
+            return {b"server": b"standin", b"proto": int(args[1]) if args[1:] else 2}
+        if command in ("CLIENT", "SELECT"):
+            return "OK"
+        return RuntimeError(f"unknown command '{command}'")
+
+    @classmethod
+    def encode(cls, value: Any, resp3: bool) -> bytes:
+        if value is None:
+            return b"_\r\n" if resp3 else b"$-1\r\n"
+        if isinstance(value, Exception):
+            return f"-ERR {value}\r\n".encode()
+        if isinstance(value, str):
+            return f"+{value}\r\n".encode()
+        if isinstance(value, int):
+            return f":{value}\r\n".encode()
+        if isinstance(value, bytes):
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        if isinstance(value, dict):
+            return b"%%%d\r\n" % len(value) + b"".join(
+                cls.encode(k, resp3) + cls.encode(v, resp3) for k, v in value.items()
+            )
+        return b"*%d\r\n" % len(value) + b"".join(cls.encode(x, resp3) for x in value)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        resp3 = False
+        try:
+            while line := await reader.readline():
+                args: List[bytes] = []
+                for _ in range(int(line[1:])):
+                    size = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(size + 2))[:-2])
+                if args[0].upper() == b"HELLO" and args[1:2] == [b"3"]:
+                    resp3 = True
+                writer.write(self.encode(self.execute(args), resp3))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
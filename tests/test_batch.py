@@ -0,0 +1,155 @@
+import asyncio
+import json
+from io import BytesIO
+from typing import Callable, List, Optional
+
+import pytest
+from PIL import Image, ImageChops
+
+from nonebot_plugin_pjsk import render
+from nonebot_plugin_pjsk.config import config
+from nonebot_plugin_pjsk.native import slice_image
+from nonebot_plugin_pjsk.render import (
+    StickerBatcher,
+    StickerRenderKwargs,
+    capture_sticker,
+    capture_sticker_batch,
+    capture_sticker_native,
+    get_sticker,
+    get_stickers,
+    render_sticker_html,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+class StubBrowser:
+    """
+    Draws the stickers natively instead of taking screenshots, batches are
+    stacked in one image like the batch page lays them out, then sliced
+    """
+
+    def __init__(self) -> None:
+        self.batches: List[int] = []
+        self.singles = 0
+        self.gate: Optional[asyncio.Event] = None
+
+    async def render_html(self, **params: StickerRenderKwargs) -> str:
+        return json.dumps(params)
+
+    async def capture(self, html: str) -> bytes:
+        self.singles += 1
+        if self.gate:
+            await self.gate.wait()
+        return await capture_sticker_native(json.loads(html))
+
+    async def capture_batch(self, htmls: List[str]) -> List[bytes]:
+        self.batches.append(len(htmls))
+        images = [
+            Image.open(BytesIO(await capture_sticker_native(json.loads(x))))
+            for x in htmls
+        ]
+        page = Image.new(
+            "RGBA",
+            (max(x.width for x in images), sum(x.height for x in images)),
+        )
+        boxes = []
+        for im in images:
+            top = sum(x[3] for x in boxes)
+            page.paste(im, (0, top))
+            boxes.append((0, top, im.width, im.height))
+        buffer = BytesIO()
+        page.save(buffer, format="PNG")
+        return slice_image(buffer.getvalue(), boxes)
+
+
+@pytest.fixture()
+def browser(monkeypatch: pytest.MonkeyPatch) -> StubBrowser:
+    stub = StubBrowser()
+    monkeypatch.setattr(render, "render_sticker_html", stub.render_html)
+    monkeypatch.setattr(render, "capture_sticker", stub.capture)
+    monkeypatch.setattr(render, "capture_sticker_batch", stub.capture_batch)
+    monkeypatch.setattr(config, "pjsk_render_backend", "browser")
+    monkeypatch.setattr(config, "pjsk_sticker_batch_size", 3)
+    return stub
+
+
+def assert_same_image(a: bytes, b: bytes):
+    with Image.open(BytesIO(a)) as x, Image.open(BytesIO(b)) as y:
+        assert x.size == y.size
+        assert (
+            ImageChops.difference(x.convert("RGBA"), y.convert("RGBA")).getbbox()
+            is None
+        )
+
+
+async def test_get_stickers_matches_single_renders(
+    browser: StubBrowser,
+    make_params: Callable[..., StickerRenderKwargs],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    params_list = [make_params(text=f"batch {i}", rotate=i * 5) for i in range(7)]
+    params_list.append(params_list[0])
+
+    monkeypatch.setattr(config, "pjsk_use_cache", False)
+    singles = [await get_sticker(**x) for x in params_list]
+    assert browser.singles == 8
+
+    monkeypatch.setattr(config, "pjsk_use_cache", True)
+    batched = await get_stickers(params_list)
+    # the duplicate is rendered once
+    assert browser.batches == [3, 3, 1]
+    for single, image in zip(singles, batched):
+        assert_same_image(single, image)
+
+    # the batch wrote every sticker to the cache
+    assert await get_stickers(params_list) == batched
+    assert await get_sticker(**params_list[3]) == batched[3]
+    assert browser.batches == [3, 3, 1]
+    assert browser.singles == 8
+
+
+async def test_get_stickers_joins_running_render(
+    browser: StubBrowser,
+    make_params: Callable[..., StickerRenderKwargs],
+):
+    params_list = [make_params(text=f"join {i}") for i in range(2)]
+    browser.gate = asyncio.Event()
+    single = asyncio.create_task(get_sticker(**params_list[0]))
+    await asyncio.sleep(0.05)
+    assert browser.singles == 1
+
+    batched = asyncio.create_task(get_stickers(params_list))
+    await asyncio.sleep(0.05)
+    # only the sticker not rendering yet is batched
+    assert browser.batches == [1]
+
+    browser.gate.set()
+    assert await single == (await batched)[0]
+    assert browser.singles == 1
+
+
+async def test_batcher_groups_requests_within_window(
+    browser: StubBrowser,
+    make_params: Callable[..., StickerRenderKwargs],
+):
+    batcher = StickerBatcher(3, 0.05)
+    params_list = [make_params(text=f"window {i}") for i in range(4)]
+
+    results = await asyncio.gather(*(batcher.submit(x) for x in params_list))
+    # the first three fill a batch, the last one waits for the window
+    assert browser.batches == [3, 1]
+    for params, image in zip(params_list, results):
+        assert_same_image(image, await capture_sticker_native(params))
+
+
+async def test_batch_slices_match_single_screenshots(
+    make_params: Callable[..., StickerRenderKwargs],
+    browser_installed: None,  # noqa: ARG001
+):
+    params_list = [make_params(text=f"shot {i}", rotate=-i * 10) for i in range(3)]
+    htmls = [await render_sticker_html(**x) for x in params_list]
+
+    batched = await capture_sticker_batch(htmls)
+    for html, image in zip(htmls, batched):
+        assert_same_image(image, await capture_sticker(html))
@@ -0,0 +1,233 @@
+import asyncio
+from typing import AsyncIterator, List, Optional
+
+import pytest
+from standin import StandInRedis
+
+from nonebot_plugin_pjsk import cache
+from nonebot_plugin_pjsk.cache import (
+    CACHE_BACKENDS,
+    CacheBackend,
+    DiskCache,
+    EvictionPolicy,
+    RedisCache,
+    create_cache_backend,
+    get_cache_backend,
+    register_cache_backend,
+    start_cache_tasks,
+    stop_cache_tasks,
+    wait_cache_cleaned,
+)
+from nonebot_plugin_pjsk.config import config
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture()
+async def redis_server(monkeypatch: pytest.MonkeyPatch) -> AsyncIterator[StandInRedis]:
+    pytest.importorskip("redis")
+    server = StandInRedis()
+    await server.start()
+    monkeypatch.setattr(config, "pjsk_cache_redis_url", server.url)
+    yield server
+    await server.stop()
+
+
+async def make_backend(name: str, monkeypatch: pytest.MonkeyPatch) -> CacheBackend:
+    monkeypatch.setattr(config, "pjsk_cache_backend", name)
+    backend = create_cache_backend()
+    await backend.clear()
+    return backend
+
+
+@pytest.fixture(params=["filesystem", "sqlite", "redis"])
+async def backend(
+    request: pytest.FixtureRequest,
+    monkeypatch: pytest.MonkeyPatch,
+) -> AsyncIterator[CacheBackend]:
+    server = None
+    if request.param == "redis":
+        pytest.importorskip("redis")
+        server = StandInRedis()
+        await server.start()
+        monkeypatch.setattr(config, "pjsk_cache_redis_url", server.url)
+    backend = await make_backend(request.param, monkeypatch)
+    yield backend
+    await backend.close()
+    if server:
+        await server.stop()
+
+
+async def test_backend_get_set_clear(backend: CacheBackend):
+    assert await backend.get("missing.png") is None
+    await backend.set("a.png", b"a")
+    await backend.set("b.png", b"b")
+    await backend.set("c.gif", b"c")
+    assert await backend.get("a.png") == b"a"
+
+    assert await backend.clear(".png") == 2
+    assert await backend.get("a.png") is None
+    assert await backend.get("c.gif") == b"c"
+    assert await backend.clear() == 1
+    assert await backend.get("c.gif") is None
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def tick(self, seconds: float = 1):
+        self.now += seconds
+
+
+@pytest.fixture()
+def disk_backend(backend: CacheBackend) -> DiskCache:
+    if not isinstance(backend, DiskCache):
+        pytest.skip("eviction is left to the server")
+    # no limits unless the test sets them
+    backend.max_bytes = backend.max_entries = backend.ttl = 0
+    backend.policy = "lru"
+    return backend
+
+
+@pytest.fixture()
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "time", clock)
+    return clock
+
+
+async def fill(backend: CacheBackend, clock: Clock, *keys: str):
+    for key in keys:
+        clock.tick()
+        await backend.set(key, key.encode() * 10)
+
+
+async def remaining(backend: CacheBackend, clock: Clock, *keys: str) -> List[str]:
+    """keys still cached, each read counts as an access in this order"""
+    result = []
+    for key in keys:
+        clock.tick()
+        if await backend.get(key) is not None:
+            result.append(key)
+    return result
+
+
+@pytest.mark.parametrize("policy", ["lru", "lfu"])
+async def test_no_eviction_within_limits(
+    disk_backend: DiskCache,
+    clock: Clock,
+    policy: EvictionPolicy,
+):
+    disk_backend.policy = policy
+    disk_backend.max_entries = 3
+    disk_backend.max_bytes = 30
+    await fill(disk_backend, clock, "a", "b", "c")
+    assert await disk_backend.evict() == 0
+    assert await remaining(disk_backend, clock, "a", "b", "c") == ["a", "b", "c"]
+
+
+async def test_lru_evicts_least_recently_used(disk_backend: DiskCache, clock: Clock):
+    disk_backend.max_entries = 2
+    await fill(disk_backend, clock, "a", "b", "c")
+    clock.tick()
+    await disk_backend.get("a")
+
+    assert await disk_backend.evict() == 1
+    assert await remaining(disk_backend, clock, "a", "b", "c") == ["a", "c"]
+
+
+async def test_lfu_evicts_least_frequently_used(disk_backend: DiskCache, clock: Clock):
+    disk_backend.policy = "lfu"
+    await fill(disk_backend, clock, "a", "b", "c")
+    for key in ["a", "a", "c", "b"]:
+        clock.tick()
+        await disk_backend.get(key)
+    # hits are now a: 2, b: 1, c: 1, ties go to the least recently used
+
+    disk_backend.max_entries = 2
+    assert await disk_backend.evict() == 1
+    disk_backend.max_entries = 0
+    assert await remaining(disk_backend, clock, "a", "b", "c") == ["a", "b"]
+
+
+async def test_evicts_over_max_bytes(disk_backend: DiskCache, clock: Clock):
+    disk_backend.max_bytes = 25
+    await fill(disk_backend, clock, "a", "b", "c")
+
+    assert await disk_backend.evict() == 1
+    assert await remaining(disk_backend, clock, "a", "b", "c") == ["b", "c"]
+
+    disk_backend.max_bytes = 15
+    assert await disk_backend.evict() == 1
+    assert await remaining(disk_backend, clock, "a", "b", "c") == ["c"]
+
+
+async def test_expired_entries_are_removed(disk_backend: DiskCache, clock: Clock):
+    disk_backend.ttl = 10
+    await fill(disk_backend, clock, "a")
+    clock.tick(8)
+    await fill(disk_backend, clock, "b", "c")
+    clock.tick(2)  # a is 11s old, b 3s
+
+    assert await disk_backend.get("a") is None
+    clock.tick(8)  # b is 11s old, c 10s
+    assert await disk_backend.evict() == 1
+    assert await disk_backend.get("b") is None
+    assert await disk_backend.get("c") is not None
+
+
+async def test_redis_backend_is_shared_and_expires(
+    redis_server: StandInRedis,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(config, "pjsk_cache_ttl", 0.2)
+    first = await make_backend("redis", monkeypatch)
+    second = await make_backend("redis", monkeypatch)
+    try:
+        assert isinstance(first, RedisCache)
+        await first.set("shared.png", b"shared")
+        assert await second.get("shared.png") == b"shared"
+        assert list(redis_server.store) == [
+            f"{config.pjsk_cache_redis_prefix}shared.png".encode(),
+        ]
+
+        await asyncio.sleep(0.3)
+        assert await second.get("shared.png") is None
+    finally:
+        await first.close()
+        await second.close()
+
+
+async def test_incomplete_backend_falls_back(monkeypatch: pytest.MonkeyPatch):
+    class IncompleteCache(CacheBackend):
+        async def get(self, key: str) -> Optional[bytes]:
+            return None
+
+    monkeypatch.setitem(CACHE_BACKENDS, "incomplete", CACHE_BACKENDS["filesystem"])
+    register_cache_backend("incomplete")(IncompleteCache)
+    monkeypatch.setattr(config, "pjsk_cache_backend", "incomplete")
+
+    backend = create_cache_backend()
+    assert type(backend) is DiskCache
+    await backend.close()
+
+
+async def test_startup_clean_finishes_before_waiters(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(config, "pjsk_clear_cache", True)
+    await get_cache_backend().set("stale.png", b"stale")
+
+    await start_cache_tasks()
+    try:
+        await wait_cache_cleaned()
+        assert await get_cache_backend().get("stale.png") is None
+        # written after the clean, so it stays
+        await get_cache_backend().set("fresh.png", b"fresh")
+        await wait_cache_cleaned()
+        assert await get_cache_backend().get("fresh.png") == b"fresh"
+    finally:
+        await stop_cache_tasks()
+        monkeypatch.setattr(cache, "clean_task", None)
@@ -0,0 +1,36 @@
+from io import BytesIO
+from typing import Any, Callable
+
+import pytest
+from PIL import Image
+
+from nonebot_plugin_pjsk import native
+from nonebot_plugin_pjsk.cache import get_cache_backend
+from nonebot_plugin_pjsk.encode import get_image_encoding
+from nonebot_plugin_pjsk.render import (
+    StickerRenderKwargs,
+    compose_stickers_grid,
+    get_grid_tile_filename,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_grid_tiles_are_cached(
+    make_params: Callable[..., StickerRenderKwargs],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    params_list = [make_params(text=str(i)) for i in range(1, 4)]
+    encoding = get_image_encoding("grid")
+    first = await compose_stickers_grid(params_list, encoding)
+    for params in params_list:
+        assert await get_cache_backend().get(get_grid_tile_filename(params))
+
+    def draw_sticker(*_: Any, **__: Any):
+        raise AssertionError("cached tile drawn again")
+
+    monkeypatch.setattr(native, "draw_sticker", draw_sticker)
+    second = await compose_stickers_grid(params_list, encoding)
+
+    with Image.open(BytesIO(first)) as a, Image.open(BytesIO(second)) as b:
+        assert a.size == b.size == (14 * 2 + 296 * 3 + 14 * 2, 14 * 2 + 256)
@@ -0,0 +1,32 @@
+import importlib.util
+import os
+from pathlib import Path
+
+import pytest
+
+SCRIPT_PATH = Path(__file__).parent.parent / "benchmarks" / "importtime.py"
+
+
+@pytest.fixture(scope="module")
+def script():
+    spec = importlib.util.spec_from_file_location("importtime", SCRIPT_PATH)
+    assert spec
+    assert spec.loader
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_import_is_deferred(script):
+    elapsed_ms, _, errors = script.check_importtime(None, script.DEFERRED_MODULES)
+    assert not errors, f"loaded in {elapsed_ms:.1f}ms: {'; '.join(errors)}"
+
+
+@pytest.mark.skipif(
+    "PJSK_IMPORTTIME_BUDGET" not in os.environ,
+    reason="wall clock budget is opt-in, set PJSK_IMPORTTIME_BUDGET to check it",
+)
+def test_import_time_budget(script):
+    budget = float(os.environ["PJSK_IMPORTTIME_BUDGET"])
+    elapsed_ms, _, errors = script.check_importtime(budget, [])
+    assert not errors, f"loaded in {elapsed_ms:.1f}ms: {'; '.join(errors)}"
@@ -0,0 +1,167 @@
+import os
+import shutil
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Callable, Dict
+
+import pytest
+from PIL import Image, ImageChops
+
+from nonebot_plugin_pjsk.native import draw_sticker
+from nonebot_plugin_pjsk.render import (
+    StickerRenderKwargs,
+    calc_text_block_size,
+    capture_sticker,
+    capture_sticker_native,
+    render_sticker_html,
+)
+from nonebot_plugin_pjsk.resource import FONT_PATH
+
+WIDTH = 296
+HEIGHT = 256
+
+CASES = [
+    pytest.param({}, id="plain"),
+    pytest.param({"rotate": -12.5}, id="rotated"),
+    pytest.param({"text": "Line one\nLine two\nthree"}, id="multiline"),
+    pytest.param({"line_spacing": 2, "text": "spaced\nlines"}, id="line-spacing"),
+    pytest.param({"stroke_width": 0}, id="no-stroke"),
+    pytest.param({"stroke_width": 16, "stroke_color": "#000000"}, id="wide-stroke"),
+    pytest.param({"x": 20, "y": 240, "rotate": -30}, id="outside-frame"),
+]
+
+# fonts with glyphs unlike the ones of `system_font`
+OTHER_FONTS = [
+    Path("/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf"),
+    Path("/usr/share/fonts/TTF/DejaVuSansMono.ttf"),
+    Path("C:/Windows/Fonts/cour.ttf"),
+]
+
+# share of pixels allowed to differ noticeably between the two backends,
+# antialiasing and hinting of the glyph edges are never exactly the same
+MAX_DIFF_RATIO = 0.03
+DIFF_THRESHOLD = 64
+
+
+def diff_ratio(a: Image.Image, b: Image.Image) -> float:
+    assert a.size == b.size
+    diff = ImageChops.difference(a.convert("RGBA"), b.convert("RGBA"))
+    # the largest difference of the channels of each pixel
+    channels = diff.split()
+    largest = channels[0]
+    for x in channels[1:]:
+        largest = ImageChops.lighter(largest, x)
+    histogram = largest.histogram()
+    return sum(histogram[DIFF_THRESHOLD:]) / (a.width * a.height)
+
+
+def test_text_outside_frame_not_clipped(sticker_font: Path, tmp_path: Path):
+    """glyphs rotated in from outside the unrotated frame are drawn, like svg"""
+
+    margin = 400
+    blank = tmp_path / "blank.png"
+    Image.new("RGBA", (WIDTH, HEIGHT)).save(blank)
+    blank_large = tmp_path / "blank_large.png"
+    Image.new("RGBA", (WIDTH + margin * 2, HEIGHT + margin * 2)).save(blank_large)
+
+    kwargs: Dict[str, Any] = {
+        "text": "Hello World\nline two",
+        "font_color": "#ff0000",
+        "font_size": 48,
+        "rotate": -30,
+        "stroke_color": "#ffffff",
+        "stroke_width": 9,
+        "line_spacing": 1.3,
+    }
+    im = draw_sticker(
+        blank,
+        sticker_font,
+        x=20,
+        y=240,
+        width=WIDTH,
+        height=HEIGHT,
+        **kwargs,
+    )
+    reference = draw_sticker(
+        blank_large,
+        sticker_font,
+        x=20 + margin,
+        y=240 + margin,
+        width=WIDTH + margin * 2,
+        height=HEIGHT + margin * 2,
+        **kwargs,
+    ).crop((margin, margin, margin + WIDTH, margin + HEIGHT))
+
+    assert im.getbbox() == reference.getbbox()
+    assert ImageChops.difference(im, reference).getbbox() is None
+
+
+def test_blank_text_keeps_image(
+    sticker_image: Path,
+    sticker_font: Path,
+    make_params: Callable[..., StickerRenderKwargs],
+):
+    im = draw_sticker(
+        sticker_image,
+        sticker_font,
+        **{
+            k: v
+            for k, v in make_params(text=" \n ").items()
+            if k not in ("image", "font")
+        },
+    )
+    with Image.open(sticker_image) as expected:
+        assert ImageChops.difference(im, expected.convert("RGBA")).getbbox() is None
+
+
+def replace_font(source: Path, mtime_ns: int):
+    """like an updated font written over the old one by the asset sync"""
+    shutil.copyfile(source, FONT_PATH)
+    os.utime(FONT_PATH, ns=(mtime_ns, mtime_ns))
+
+
+def test_replaced_font_is_used(
+    sticker_image: Path,
+    sticker_font: Path,
+    system_font: Path,
+    make_params: Callable[..., StickerRenderKwargs],
+):
+    if not (other := next((x for x in OTHER_FONTS if x.is_file()), None)):
+        pytest.skip("No second font found on this system")
+
+    def draw() -> Image.Image:
+        return draw_sticker(
+            sticker_image,
+            sticker_font,
+            **{
+                k: v
+                for k, v in make_params(text="mmm").items()
+                if k not in ("image", "font")
+            },
+        )
+
+    mtime_ns = sticker_font.stat().st_mtime_ns
+    before = draw()
+    before_size = calc_text_block_size("mmm", 36, 0)
+    try:
+        replace_font(other, mtime_ns + 1_000_000_000)
+        assert diff_ratio(draw(), before) > 0
+        assert calc_text_block_size("mmm", 36, 0) != before_size
+    finally:
+        replace_font(system_font, mtime_ns + 2_000_000_000)
+
+
+@pytest.mark.anyio()
+@pytest.mark.parametrize("overrides", CASES)
+async def test_native_matches_browser(
+    make_params: Callable[..., StickerRenderKwargs],
+    browser_installed: None,  # noqa: ARG001
+    overrides: Dict[str, Any],
+):
+    params = make_params(**overrides)
+    browser = await capture_sticker(await render_sticker_html(**params))
+    native = await capture_sticker_native(params)
+
+    with Image.open(BytesIO(browser)) as a, Image.open(BytesIO(native)) as b:
+        assert a.size == b.size == (WIDTH, HEIGHT)
+        assert diff_ratio(a, b) <= MAX_DIFF_RATIO
@@ -0,0 +1,17 @@
+import asyncio
+
+from nonebot_plugin_pjsk.page import PagePool
+
+
+def test_pool_semaphore_is_bound_to_running_loop():
+    # created outside of any loop like the module level pool
+    pool = PagePool(1, 10)
+
+    async def hold():
+        async with pool.semaphore:
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(hold(), hold(), hold())
+
+    asyncio.run(main())
@@ -0,0 +1,172 @@
+import asyncio
+import time
+from typing import AsyncIterator
+
+import pytest
+from standin import SLOW_DELAY, StandInServer
+
+from nonebot_plugin_pjsk.config import config
+from nonebot_plugin_pjsk.utils import (
+    ResponseType,
+    async_request,
+    background_tasks,
+    cancel_background_tasks,
+    close_client,
+    create_background_task,
+    get_backoff_delay,
+    get_client,
+    race_first_success,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+async def fast_backoff(monkeypatch: pytest.MonkeyPatch) -> AsyncIterator[None]:
+    monkeypatch.setattr(config, "pjsk_req_backoff_base", 0.01)
+    monkeypatch.setattr(config, "pjsk_req_backoff_max", 0.05)
+    monkeypatch.setattr(config, "pjsk_req_race", False)
+    yield
+    await close_client()
+
+
+async def test_backoff_delay_bounds(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(config, "pjsk_req_backoff_base", 0.5)
+    monkeypatch.setattr(config, "pjsk_req_backoff_max", 3)
+    for attempt, cap in enumerate([0.5, 1, 2, 3, 3]):
+        delays = [get_backoff_delay(attempt) for _ in range(200)]
+        assert all(0 <= x <= cap for x in delays)
+        # full jitter, not a fixed delay
+        assert len(set(delays)) > 1
+
+
+async def test_client_is_reused():
+    assert get_client() is get_client()
+    await close_client()
+    assert not get_client().is_closed
+
+
+async def test_retries_until_success(server: StandInServer):
+    path = "/fail-2/image.png"
+    data = await async_request(server.url + path, retries=2)
+    assert data == path.encode()
+    assert server.hits[path] == 3
+
+
+async def test_gives_up_after_retries(server: StandInServer):
+    from httpx import HTTPStatusError
+
+    path = "/fail-5/image.png"
+    with pytest.raises(HTTPStatusError):
+        await async_request(server.url + path, retries=1)
+    assert server.hits[path] == 2
+
+
+async def test_falls_back_to_next_mirror(server: StandInServer):
+    data = await async_request(
+        f"{server.url}/fail-9/a.png",
+        f"{server.url}/ok/a.png",
+        retries=0,
+    )
+    assert data == b"/ok/a.png"
+
+
+async def test_race_returns_faster_mirror(
+    server: StandInServer,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(config, "pjsk_req_race", True)
+    start = time.perf_counter()
+    data = await async_request(
+        f"{server.url}/slow/a.png",
+        f"{server.url}/ok/a.png",
+        retries=0,
+    )
+    assert data == b"/ok/a.png"
+    assert time.perf_counter() - start < SLOW_DELAY
+
+
+async def test_race_falls_back_after_both_fail(
+    server: StandInServer,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(config, "pjsk_req_race", True)
+    data = await async_request(
+        f"{server.url}/fail-9/a.png",
+        f"{server.url}/fail-9/b.png",
+        f"{server.url}/ok/c.png",
+        retries=0,
+    )
+    assert data == b"/ok/c.png"
+
+
+async def test_race_cancels_loser():
+    cancelled = asyncio.Event()
+
+    async def winner() -> str:
+        await asyncio.sleep(0.01)
+        return "winner"
+
+    async def loser() -> str:
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return "loser"
+
+    assert await race_first_success(loser(), winner()) == "winner"
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+
+async def test_race_waits_past_failure():
+    async def failing() -> str:
+        raise ValueError("failed")
+
+    async def slower() -> str:
+        await asyncio.sleep(0.05)
+        return "slower"
+
+    assert await race_first_success(failing(), slower()) == "slower"
+
+
+async def test_race_raises_when_all_fail():
+    async def failing() -> str:
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError, match="failed"):
+        await race_first_success(failing(), failing())
+
+
+async def test_raw_response_keeps_not_modified(server: StandInServer):
+    server.files["/a.png"] = b"image"
+    url = f"{server.url}/a.png"
+    response = await async_request(url, response_type=ResponseType.RESPONSE)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    response = await async_request(
+        url,
+        response_type=ResponseType.RESPONSE,
+        headers={"If-None-Match": etag},
+    )
+    assert response.status_code == 304
+    assert server.hits["/a.png"] == 2
+
+
+async def test_background_tasks_are_cancelled_and_awaited():
+    cleaned = asyncio.Event()
+
+    async def revalidate():
+        try:
+            await asyncio.sleep(10)
+        finally:
+            await asyncio.sleep(0)
+            cleaned.set()
+
+    task = create_background_task(revalidate())
+    await asyncio.sleep(0)
+    await cancel_background_tasks()
+    assert task.cancelled()
+    assert cleaned.is_set()
+    assert not background_tasks
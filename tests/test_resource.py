@@ -0,0 +1,145 @@
+import gc
+import tarfile
+import weakref
+from io import BytesIO
+from pathlib import Path
+from typing import Dict
+
+import pytest
+from nonebot.compat import type_validate_python
+from standin import StandInServer, make_etag
+
+from nonebot_plugin_pjsk import resource
+from nonebot_plugin_pjsk.config import config
+from nonebot_plugin_pjsk.resource import (
+    RESOURCE_FOLDER,
+    StickerCatalog,
+    StickerInfo,
+    asset_manifest,
+    bootstrap_assets,
+    fetched_assets,
+    revalidate_asset,
+    write_asset,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+def make_legacy_asset(name: str, data: bytes) -> Path:
+    """an asset downloaded before the manifest existed, without validators"""
+
+    path = RESOURCE_FOLDER / "revalidate" / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    asset_manifest.update(path, data)
+    fetched_assets.discard(path)
+    return path
+
+
+async def test_unchanged_legacy_asset_is_not_downloaded(server: StandInServer):
+    path = make_legacy_asset("same.png", b"image")
+    server.files["/same.png"] = b"image"
+
+    assert not await revalidate_asset(path, [f"{server.url}/same.png"])
+    assert server.methods == {"HEAD": 1}
+    record = asset_manifest.get(path)
+    assert record
+    assert record.etag == make_etag(b"image")
+
+    # validators taken from the HEAD response are used from now on
+    assert not await revalidate_asset(path, [f"{server.url}/same.png"])
+    assert server.methods == {"HEAD": 1, "GET": 1}
+    assert path.read_bytes() == b"image"
+
+
+async def test_changed_legacy_asset_is_downloaded(server: StandInServer):
+    path = make_legacy_asset("changed.png", b"image")
+    server.files["/changed.png"] = b"new image"
+
+    assert await revalidate_asset(path, [f"{server.url}/changed.png"])
+    assert server.methods == {"HEAD": 1, "GET": 1}
+    assert path.read_bytes() == b"new image"
+
+
+async def test_asset_fetched_this_run_is_skipped(server: StandInServer):
+    path = RESOURCE_FOLDER / "revalidate" / "fresh.png"
+    await write_asset(path, b"image")
+    server.files["/fresh.png"] = b"new image"
+
+    assert not await revalidate_asset(path, [f"{server.url}/fresh.png"])
+    assert not server.methods
+
+
+def make_archive(files: Dict[str, bytes]) -> bytes:
+    buffer = BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tf:
+        for name, data in files.items():
+            info = tarfile.TarInfo(f"sekai-stickers-main/public/img/{name}")
+            info.size = len(data)
+            tf.addfile(info, BytesIO(data))
+    return buffer.getvalue()
+
+
+def make_sticker_info(img: str) -> StickerInfo:
+    return type_validate_python(
+        StickerInfo,
+        {
+            "id": img,
+            "name": img,
+            "character": "bootstrap",
+            "img": img,
+            "color": "#ffffff",
+            "defaultText": {"text": "text", "x": 0, "y": 0, "r": 0, "s": 40},
+        },
+    )
+
+
+async def test_bootstrap_skips_present_assets_and_archives(
+    server: StandInServer,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    files = {f"bootstrap/{i}.png": f"image {i}".encode() for i in range(3)}
+    present = RESOURCE_FOLDER / "bootstrap" / "0.png"
+    present.parent.mkdir(parents=True, exist_ok=True)
+    present.write_bytes(files["bootstrap/0.png"])
+    asset_manifest.update(present, files["bootstrap/0.png"])
+    mtime = present.stat().st_mtime_ns
+
+    server.files["/first.tar.gz"] = make_archive(files)
+    server.files["/second.tar.gz"] = make_archive(files)
+    monkeypatch.setattr(
+        resource,
+        "sticker_catalog",
+        StickerCatalog([make_sticker_info(x) for x in files]),
+    )
+    monkeypatch.setattr(
+        config,
+        "pjsk_bootstrap_archive_urls",
+        [f"{server.url}/first.tar.gz", f"{server.url}/second.tar.gz"],
+    )
+    monkeypatch.setattr(config, "pjsk_bootstrap_min_missing", 1)
+
+    await bootstrap_assets()
+
+    for name, data in files.items():
+        assert (RESOURCE_FOLDER / name).read_bytes() == data
+    assert present.stat().st_mtime_ns == mtime
+    assert RESOURCE_FOLDER / "bootstrap" / "1.png" in fetched_assets
+    # nothing was missing any more after the first archive
+    assert server.hits == {"/first.tar.gz": 1}
+
+
+def test_resolve_character_does_not_keep_catalog():
+    catalog = StickerCatalog(
+        [make_sticker_info("a.png")],
+        {"bs": "bootstrap"},
+    )
+    assert catalog.resolve_character("Boot Strap") == "bootstrap"
+    assert catalog.resolve_character("bs") == "bootstrap"
+    assert catalog.resolve_character("boot") == "bootstrap"
+    assert catalog.resolve_character("nobody") is None
+
+    ref = weakref.ref(catalog)
+    del catalog
+    gc.collect()
+    assert ref() is None
@@ -0,0 +1,158 @@
+import asyncio
+from typing import List, Optional
+
+import pytest
+
+from nonebot_plugin_pjsk import render
+from nonebot_plugin_pjsk.config import config
+from nonebot_plugin_pjsk.encode import ImageEncoding
+from nonebot_plugin_pjsk.render import use_cache
+from nonebot_plugin_pjsk.scheduler import (
+    Priority,
+    RenderBusyError,
+    RenderScheduler,
+    Requester,
+    render_priority,
+    requester_var,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_background_queue_does_not_reject_foreground():
+    scheduler = RenderScheduler(1, 2)
+    order: List[str] = []
+    release = asyncio.Event()
+
+    async def render(name: str, priority: Priority):
+        async with scheduler.slot(priority):
+            order.append(name)
+            await release.wait()
+
+    tasks = [asyncio.create_task(render("running", Priority.INTERACTIVE))]
+    await asyncio.sleep(0)
+    tasks += [
+        asyncio.create_task(render(f"background{i}", Priority.BACKGROUND))
+        for i in range(2)
+    ]
+    await asyncio.sleep(0)
+    assert scheduler.queue_depth == 2
+
+    tasks.append(asyncio.create_task(render("interactive", Priority.INTERACTIVE)))
+    await asyncio.sleep(0)
+    assert scheduler.queue_depth == 3
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert order == ["running", "interactive", "background0", "background1"]
+
+
+async def test_full_foreground_queue_rejects():
+    scheduler = RenderScheduler(1, 2)
+    release = asyncio.Event()
+
+    async def render(priority: Priority):
+        async with scheduler.slot(priority):
+            await release.wait()
+
+    tasks = [
+        asyncio.create_task(render(Priority.INTERACTIVE)),
+        asyncio.create_task(render(Priority.GRID)),
+        asyncio.create_task(render(Priority.INTERACTIVE)),
+    ]
+    await asyncio.sleep(0)
+    assert scheduler.foreground_queue_depth == 2
+
+    with pytest.raises(RenderBusyError):
+        await render(Priority.INTERACTIVE)
+
+    # background renders are never rejected
+    tasks.append(asyncio.create_task(render(Priority.BACKGROUND)))
+    await asyncio.sleep(0)
+    assert scheduler.queue_depth == 3
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert scheduler.running == 0
+
+
+async def test_promoted_background_render_runs_before_foreground():
+    scheduler = RenderScheduler(1, 2)
+    order: List[str] = []
+    release = asyncio.Event()
+
+    async def render(name: str, priority: Priority, key: Optional[str] = None):
+        async with scheduler.slot(priority, key):
+            order.append(name)
+            await release.wait()
+
+    tasks = [
+        asyncio.create_task(render("running", Priority.INTERACTIVE)),
+        asyncio.create_task(render("prerender", Priority.BACKGROUND, "grid.png")),
+        asyncio.create_task(render("interactive", Priority.INTERACTIVE)),
+    ]
+    await asyncio.sleep(0)
+    assert scheduler.foreground_queue_depth == 1
+
+    # an interactive request joins the queued background render
+    scheduler.promote("grid.png", Priority.INTERACTIVE)
+    assert scheduler.foreground_queue_depth == 2
+    # lower priorities never demote it
+    scheduler.promote("grid.png", Priority.BACKGROUND)
+    assert scheduler.foreground_queue_depth == 2
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert order == ["running", "prerender", "interactive"]
+    assert not scheduler._queued_keys
+
+
+async def test_refilled_buckets_are_pruned():
+    scheduler = RenderScheduler(1, 2, user_rate=1000, user_burst=2)
+    token = requester_var.set(Requester("user"))
+    try:
+        scheduler.check_rate_limit()
+    finally:
+        requester_var.reset(token)
+    assert scheduler.prune_buckets() == 0
+
+    await asyncio.sleep(0.01)
+    assert scheduler.prune_buckets() == 1
+    assert not scheduler._buckets
+
+
+async def test_interactive_request_promotes_joined_render(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(render, "render_scheduler", RenderScheduler(1, 2))
+    monkeypatch.setattr(config, "pjsk_use_cache", False)
+    order: List[str] = []
+    release = asyncio.Event()
+
+    def make_getter(name: str):
+        @use_cache(name, "grid")
+        async def get_image(encoding: ImageEncoding) -> bytes:
+            order.append(name)
+            await release.wait()
+            return name.encode()
+
+        return get_image
+
+    get_running, get_prerender, get_other = map(
+        make_getter,
+        ["running", "prerender", "interactive"],
+    )
+    tasks = [asyncio.create_task(get_running())]
+    await asyncio.sleep(0)
+    with render_priority(Priority.BACKGROUND):
+        tasks.append(asyncio.create_task(get_prerender()))
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(get_other()))
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(get_prerender()))
+    await asyncio.sleep(0)
+
+    release.set()
+    results = await asyncio.gather(*tasks)
+    assert results == [b"running", b"prerender", b"interactive", b"prerender"]
+    assert order == ["running", "prerender", "interactive"]
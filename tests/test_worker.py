@@ -0,0 +1,72 @@
+from typing import Any
+
+import pytest
+
+from nonebot_plugin_pjsk.worker import (
+    WORKER_JOBS,
+    RenderWorker,
+    RenderWorkerError,
+    RenderWorkerPool,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+class CrashingWorker(RenderWorker):
+    """pretends to be running until it gets a job, then exits"""
+
+    def __init__(self, index: int) -> None:
+        super().__init__(index)
+        self.crashed = False
+        self.jobs = 0
+
+    @property
+    def alive(self) -> bool:
+        return not self.crashed
+
+    async def run(self, name: str, *args: Any) -> bytes:
+        self.jobs += 1
+        self.crashed = True
+        raise RenderWorkerError("Render worker exited with code 1")
+
+
+class FailingWorker(CrashingWorker):
+    async def run(self, name: str, *args: Any) -> bytes:
+        self.jobs += 1
+        raise RenderWorkerError("ValueError: bad job")
+
+
+@pytest.fixture(autouse=True)
+def echo_job(monkeypatch: pytest.MonkeyPatch):
+    async def echo(data: bytes) -> bytes:
+        return b"in process " + data
+
+    monkeypatch.setitem(WORKER_JOBS, "echo", echo)
+
+
+async def test_runs_in_process_without_workers():
+    pool = RenderWorkerPool(2)
+    assert await pool.run("echo", b"job") == b"in process job"
+
+
+async def test_retries_in_another_worker():
+    pool = RenderWorkerPool(2)
+    pool.workers = [CrashingWorker(0), CrashingWorker(1)]
+    with pytest.raises(RenderWorkerError, match="exited"):
+        await pool.run("echo", b"job")
+    assert [x.jobs for x in pool.workers] == [1, 1]
+
+
+async def test_falls_back_in_process_when_last_worker_exits():
+    pool = RenderWorkerPool(1)
+    pool.workers = [CrashingWorker(0)]
+    assert await pool.run("echo", b"job") == b"in process job"
+    assert pool.workers[0].jobs == 1
+
+
+async def test_job_error_is_not_retried():
+    pool = RenderWorkerPool(1)
+    pool.workers = [FailingWorker(0)]
+    with pytest.raises(RenderWorkerError, match="bad job"):
+        await pool.run("echo", b"job")
+    assert pool.workers[0].jobs == 1